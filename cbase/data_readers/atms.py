@@ -1,7 +1,7 @@
 from dataclasses import dataclass
 import numpy as np
 import xarray as xr
-from datetime import datetime
+from cbase.utils.utils import utc_fields_to_datetime64
 
 
 ATMS_KEYS = [
@@ -134,45 +134,13 @@ class ATMSData:
         )
 
 
-def convert_to_datetime(utc_array) -> np.ndarray[datetime]:
-    """convert ATMS timestamps to datetime
+def convert_to_datetime(utc_array) -> np.ndarray:
+    """convert ATMS timestamps to datetime64[ns]
     ATMS time stamps come as tuples of 8 values
     pertaining to names of the elements of UTC when
     it is expressed as an array of
     integers year,month,day,hour,minute,second,
     millisecond,microsecond
+    Timestamps with any missing element are set to NaT
     """
-
-    year = utc_array[:, :, 0].astype(float)
-    month = utc_array[:, :, 1].astype(float)
-    day = utc_array[:, :, 2].astype(float)
-    hour = utc_array[:, :, 3].astype(float)
-    minute = utc_array[:, :, 4].astype(float)
-    second = utc_array[:, :, 5].astype(float)
-
-    datetime_objects = np.full(year.shape, None, dtype=object)
-    nan_mask = (
-        np.isnan(year)
-        | np.isnan(month)
-        | np.isnan(day)
-        | np.isnan(hour)
-        | np.isnan(minute)
-        | np.isnan(second)
-    )
-    datetime_objects[nan_mask] = np.nan
-    valid_mask = ~nan_mask
-    # Create datetime objects
-    datetime_objects[valid_mask] = np.array(
-        [
-            datetime(int(y), int(m), int(d), int(h), int(mi), int(s))
-            for y, m, d, h, mi, s in zip(
-                year[valid_mask],
-                month[valid_mask],
-                day[valid_mask],
-                hour[valid_mask],
-                minute[valid_mask],
-                second[valid_mask],
-            )
-        ]
-    )
-    return datetime_objects
+    return utc_fields_to_datetime64(utc_array[..., :8])
@@ -1,17 +1,37 @@
 import os
-import time
-from datetime import datetime, timedelta
+from datetime import datetime
 from pathlib import Path
-from dataclasses import dataclass
-import pytz
+from dataclasses import dataclass, fields
+from typing import Union
 from pyhdf.SD import SD, SDC
 from pyhdf.HDF import HDF  # HC
 from pyhdf import VS
 import xarray as xr
 import numpy as np
-from scipy.interpolate import interp1d
+from cbase.utils.interpolation import interpolate_columns
+from cbase.utils.utils import seconds_to_datetime64, tai93_to_datetime64
+from cbase.utils.cache import (
+    cache_key,
+    file_identity,
+    load_npz_cache,
+    save_npz_cache,
+)
 
 FILL_VALUE = -999.9
+CLOUDSAT_CACHE_VERSION = 3  # increase when the derived track changes
+
+# variables of the 2B-CLDCLASS-LIDAR file used by CloudsatData
+CLOUDSAT_VARIABLES = [
+    "Longitude",
+    "Latitude",
+    "LayerTop",
+    "LayerBase",
+    "CloudLayers",
+    "FlagBase",
+    "CloudFraction",
+    "Profile_time",
+    "TAI_start",
+]
 
 
 @dataclass
@@ -44,22 +64,60 @@ class CloudsatData:
     cloud_base_temp: np.array
     time: np.array
     name: str
+    source_files: tuple = ()  # file_identity of the input files
 
     @classmethod
-    def from_files(cls, cldclass_lidar_file: Path, dardar_cloud_file: Path):
+    def from_files(
+        cls,
+        cldclass_lidar_file: Path,
+        dardar_cloud_file: Path,
+        time_range: Union[tuple[np.datetime64, np.datetime64], None] = None,
+        cache_path: Union[str, None] = None,
+    ):
         """
         read cloudsat data and
-        generate constructor from file
+        generate constructor from file,
+        optionally only the profiles within time_range.
+        With a cache_path the derived track is read from/written to a
+        cache file keyed by the two input files
         """
         if cldclass_lidar_file and dardar_cloud_file:
-            csat_dict = read_cloudsat_hdf4(cldclass_lidar_file.as_posix())
+            name = os.path.basename(cldclass_lidar_file.as_posix())
+            cache_file = None
+            source_files = (
+                file_identity(cldclass_lidar_file.as_posix()),
+                file_identity(dardar_cloud_file.as_posix()),
+            )
+            if cache_path is not None:
+                cache_file = cloudsat_cache_file(
+                    cache_path, cldclass_lidar_file, dardar_cloud_file, time_range
+                )
+                cloudsat = cls.from_cache(cache_file, name, source_files)
+                if cloudsat is not None:
+                    return cloudsat
+
+            profiles = None
+            if time_range is not None:
+                profiles = get_profile_range(
+                    cldclass_lidar_file.as_posix(), *time_range
+                )
+                if profiles[1] <= profiles[0]:
+                    raise ValueError(
+                        f"No Cloudsat profiles in {cldclass_lidar_file} "
+                        f"within {time_range[0]} - {time_range[1]}"
+                    )
+            csat_dict = read_cloudsat_hdf4(
+                cldclass_lidar_file.as_posix(), CLOUDSAT_VARIABLES, profiles
+            )
             vis_optical_depth, temp_profile, height = get_dardar_parameters(
-                dardar_cloud_file.as_posix()
+                dardar_cloud_file.as_posix(),
+                profiles,
+                get_base_height(csat_dict["LayerBase"]),
             )
             cloud_base_temp = get_base_temp(
                 csat_dict["LayerBase"], temp_profile, height
             )
-            return cls(
+            cloudsat = cls(
                 csat_dict["Longitude"].ravel() % 360,
                 csat_dict["Latitude"].ravel(),
                 get_top_height(csat_dict["LayerTop"]),
@@ -71,13 +129,58 @@ class CloudsatData:
                 vis_optical_depth,
                 cloud_base_temp,
                 get_time(csat_dict),
-                os.path.basename(cldclass_lidar_file.as_posix()),
+                name,
+                source_files,
             )
+            if cache_file is not None:
+                cloudsat.to_cache(cache_file)
+            return cloudsat
 
         raise ValueError(
             "Both cldclass_lidar_file and dardar_cloudfile need to be provided"
         )
 
+    @classmethod
+    def from_cache(cls, cache_file: str, name: str, source_files: tuple = ()):
+        """derived track from a cache file, None if there is no valid cache"""
+        cache = load_npz_cache(cache_file)
+        if cache is None:
+            return None
+        try:
+            return cls(**cache, name=name, source_files=source_files)
+        except TypeError as e:
+            print(f"Ignoring cache file {cache_file} with other fields: {e}")
+            return None
+
+    def to_cache(self, cache_file: str):
+        """write all per profile arrays of the track to a cache file"""
+        save_npz_cache(
+            cache_file,
+            {
+                field.name: getattr(self, field.name)
+                for field in fields(self)
+                if field.name not in ("name", "source_files")
+            },
+        )
+
+
+def cloudsat_cache_file(
+    cache_path: str,
+    cldclass_lidar_file: Path,
+    dardar_cloud_file: Path,
+    time_range: Union[tuple[np.datetime64, np.datetime64], None] = None,
+) -> str:
+    """cache file of the derived Cloudsat track, keyed by the identity of
+    the input files, the time range and CLOUDSAT_CACHE_VERSION"""
+    key = cache_key(
+        CLOUDSAT_CACHE_VERSION,
+        file_identity(cldclass_lidar_file.as_posix()),
+        file_identity(dardar_cloud_file.as_posix()),
+        None if time_range is None else [str(t) for t in time_range],
+    )
+    name = os.path.basename(cldclass_lidar_file.as_posix())[:22]
+    return os.path.join(cache_path, f"cloudsat_{name}_{key}.npz")
+
 
 def get_top_height(cth: np.array) -> np.array:
     """get height of highest cloud out of n layers"""
@@ -103,44 +206,184 @@ def get_base_height(cbh: np.array) -> np.array:
 
 
 def get_base_temp(cbh_profile, temp_profile, height):
-    cbh = get_base_height(cbh_profile)
-    return np.array(
-        [
-            interp1d(height, temp_profile[i, :])(cbh[i])
-            for i in range(temp_profile.shape[0])
-        ]
+    """temperature at the lowest cloud base of each profile"""
+    return sample_profiles(temp_profile, height, get_base_height(cbh_profile))
+
+
+def sample_profiles(
+    profiles: np.ndarray, height: np.ndarray, target_height: np.ndarray
+) -> np.ndarray:
+    """
+    linear interpolation of all DARDAR profiles (profile, level) on the
+    height grid to one target height per profile, e.g. temperature or ice
+    water content at cloud base. Missing targets (< 0) and targets outside
+    the height grid give FILL_VALUE
+    """
+    target_height = np.asarray(target_height, dtype=np.float64)
+    sampled = interpolate_columns(
+        height,
+        profiles,
+        target_height,
+        axis=1,
+        fill_value=FILL_VALUE,
     )
+    sampled[target_height < 0] = FILL_VALUE
+    return sampled
 
 
-def read_cloudsat_hdf4(filepath: str) -> dict:
-    """access variables in a hdf4 file, and dump them all to a dict"""
+def read_cloudsat_hdf4(
+    filepath: str,
+    names: Union[list[str], None] = None,
+    profiles: Union[tuple[int, int], None] = None,
+) -> dict:
+    """
+    access variables in a hdf4 file and dump them to a dict, all of them or
+    only the given names, optionally only the profiles in [start, end)
+    """
     all_data = {}
     h4file = SD(filepath, SDC.READ)
-    datasets = h4file.datasets()
+    try:
+        for sds_name in h4file.datasets():
+            if names is None or sds_name in names:
+                all_data[sds_name] = _read_sds(h4file, sds_name, profiles)
+    finally:
+        h4file.end()
+
+    vdata_names = None if names is None else [n for n in names if n not in all_data]
+    all_data.update(read_cloudsat_vdata(filepath, vdata_names, profiles))
+    return all_data
+
+
+def _read_sds(
+    h4file: SD, name: str, profiles: Union[tuple[int, int], None]
+) -> np.ndarray:
+    """read a SDS, only the profiles in [start, end) along the first axis"""
+    sds = h4file.select(name)
+    try:
+        if profiles is None:
+            return np.array(sds.get())
+        dims = [int(dim) for dim in np.atleast_1d(sds.info()[2])]
+        start, end = profiles[0], min(profiles[1], dims[0])
+        if end <= start:  # pyhdf cannot read an empty hyperslab
+            first = np.array(sds.get(start=[0] * len(dims), count=[1] * len(dims)))
+            return np.empty([0] + dims[1:], dtype=first.dtype)
+        return np.array(
+            sds.get(
+                start=[start] + [0] * (len(dims) - 1),
+                count=[end - start] + dims[1:],
+            )
+        )
+    finally:
+        sds.endaccess()
 
-    for _, sds in enumerate(datasets.keys()):
-        all_data[sds] = np.array(h4file.select(sds).get())
 
+def read_cloudsat_vdata(
+    filepath: str,
+    names: Union[list[str], None] = None,
+    profiles: Union[tuple[int, int], None] = None,
+) -> dict:
+    """
+    read 1D data compound/Vdata fields of a hdf4 file, all of them or only
+    the given names. With profiles only records [start, end) of the per
+    profile fields are read, single record fields like TAI_start are read
+    as they are
+    """
+    data = {}
     h4file = HDF(filepath, SDC.READ)
     vs = h4file.vstart()
-    data_info_list = vs.vdatainfo()
-    for item in data_info_list:
-        # 1D data compound/Vdata
-        name = item[0]
-        all_data[name] = np.array(vs.attach(name)[:])
-
-    return all_data
+    try:
+        if names is None:  # all named Vdata with records
+            names = [item[0] for item in vs.vdatainfo() if item[0] and item[3] > 0]
+        for name in names:
+            vd = vs.attach(name)
+            try:
+                nrecs = vd.inquire()[0]
+                if profiles is None or nrecs <= 1:
+                    data[name] = np.array(vd[:])
+                    continue
+                start, end = profiles[0], min(profiles[1], nrecs)
+                if end > start:
+                    vd.seek(start)
+                    data[name] = np.array(vd.read(end - start))
+                else:
+                    data[name] = np.array([])
+            finally:
+                vd.detach()
+    finally:
+        vs.end()
+        h4file.close()
+    return data
+
+
+def read_cloudsat_geolocation(filepath: str) -> dict:
+    """read only lat/lon/time of Cloudsat profiles, without the cloud data"""
+    geolocation = read_cloudsat_vdata(
+        filepath, ["Latitude", "Longitude", "Profile_time", "TAI_start"]
+    )
+    return {
+        "latitude": geolocation["Latitude"].ravel(),
+        "longitude": geolocation["Longitude"].ravel() % 360,
+        "time": get_time(geolocation),
+    }
+
+
+def get_profile_range(
+    filepath: str, start: np.datetime64, end: np.datetime64
+) -> tuple[int, int]:
+    """[first, last + 1) index of the profiles with time within [start, end]"""
+    times = get_time(read_cloudsat_vdata(filepath, ["Profile_time", "TAI_start"]))
+    return (
+        int(np.searchsorted(times, start, side="left")),
+        int(np.searchsorted(times, end, side="right")),
+    )
 
 
-def get_dardar_parameters(dardarfile: str):
+def get_dardar_parameters(
+    dardarfile: str,
+    profiles: Union[tuple[int, int], None] = None,
+    base_height: Union[np.ndarray, None] = None,
+):
+    """
+    read vis_optical_depth, temperature and height from a DARDAR file.
+    The file is opened lazily and only the profiles in [start, end) are read,
+    with base_height only the temperature levels needed to interpolate
+    to the cloud bases
+    """
     with xr.open_dataset(dardarfile) as dardar:
+        height = dardar.height.values
+        profile_dim, level_dim = dardar.temperature.dims
+        if profiles is not None:
+            dardar = dardar.isel({profile_dim: slice(*profiles)})
+        if base_height is not None:
+            levels = get_level_range(height, base_height)
+            dardar = dardar.isel({level_dim: slice(*levels)})
+            height = height[levels[0] : levels[1]]
         return (
             dardar.vis_optical_depth.values,
             dardar.temperature.values,
-            dardar.height.values,
+            height,
         )
 
 
+def get_level_range(height: np.ndarray, target_height: np.ndarray) -> tuple:
+    """
+    [first, last + 1) index of the monotonic height levels that bracket all
+    valid (>= 0) target heights, interpolating on these levels gives the
+    same result as on the full grid
+    """
+    valid = target_height[np.isfinite(target_height) & (target_height >= 0)]
+    if valid.size == 0:
+        return 0, min(2, len(height))
+    order = np.argsort(height)
+    sorted_height = height[order]
+    first = np.searchsorted(sorted_height, valid.min(), side="right") - 1
+    first = max(min(first, len(height) - 2), 0)
+    last = min(np.searchsorted(sorted_height, valid.max()), len(height) - 1)
+    last = max(last, first + 1)
+    levels = order[first : last + 1]
+    return int(levels.min()), int(levels.max()) + 1
+
+
 def get_cloud_fraction(cf: np.array) -> np.array:
     """max cloud fraction in multiple layers"""
     cf_copy = cf.astype(float)
@@ -154,18 +397,16 @@ def get_cloud_fraction(cf: np.array) -> np.array:
 
 
 def get_time(all_data):
-    """convert time from TAI units to datetime"""
-    dsec = time.mktime((1993, 1, 1, 0, 0, 0, 0, 0, 0)) - time.timezone
-    sec_1970 = all_data["Profile_time"].ravel() + all_data["TAI_start"].ravel() + dsec
-
-    times = convert2datetime(sec_1970, BaseDate("197001010000"))
-    return times
+    """convert time from TAI units to datetime64[ns]"""
+    return tai93_to_datetime64(
+        all_data["Profile_time"].ravel() + all_data["TAI_start"].ravel()
+    )
 
 
 def convert2datetime(times: np.array, base_date_string: BaseDate) -> np.array:
-    """convert time from secs to datetime objects"""
+    """convert time from secs to datetime64[ns] (UTC)"""
 
-    base_date = datetime.strptime(base_date_string.base_date, "%Y%m%d%H%M").replace(
-        tzinfo=pytz.UTC
+    base_date = np.datetime64(
+        datetime.strptime(base_date_string.base_date, "%Y%m%d%H%M"), "ns"
     )
-    return np.array([base_date + timedelta(seconds=value) for value in times])
+    return seconds_to_datetime64(times, base_date)
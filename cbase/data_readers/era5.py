@@ -1,5 +1,6 @@
 from pathlib import Path
 from dataclasses import dataclass
+from typing import Union
 from enum import Enum
 import numpy as np
 from scipy.interpolate import interp1d
@@ -52,12 +53,61 @@ class Era5:
         """a new wrapper class for GRIB data, uses PPS_NWP,"""
         return Era5(GRIBFile(filepath.as_posix()))
 
+    def __post_init__(self):
+        self._pressure_level_fields = {}
+
+    def set_projection(self, projection: tuple[np.ndarray, np.ndarray]):
+        """set the target geometry, the horizontal interpolation is then
+        reused for every parameter read until the projection changes"""
+        self.grb.set_projection(projection)
+        self._pressure_level_fields = {}
+
     def get_data(
         self, parameter: str, projection=tuple[np.ndarray, np.ndarray]
     ) -> np.ndarray:
         """read in the required parameter and also allows to set the projection"""
 
-        self.grb.set_projection(projection)
+        self.set_projection(projection)
+        return self.read_parameter(parameter)
+
+    def get_fields(
+        self,
+        parameters: list[str],
+        projection: tuple[np.ndarray, np.ndarray],
+        fill_value: Union[float, None] = None,
+    ) -> dict[str, np.ndarray]:
+        """
+        read all parameters for one target geometry, the projection is set
+        only once. If fill_value is given, parameters that cannot be read are
+        filled with it instead of raising
+        """
+        self.set_projection(projection)
+        fields = {}
+        for parameter in parameters:
+            try:
+                fields[parameter] = self.read_parameter(parameter)
+            except Exception:
+                if fill_value is None:
+                    raise
+                fields[parameter] = np.full(np.shape(projection[0]), fill_value)
+        return fields
+
+    def _t_pressure(self, level: int) -> np.ndarray:
+        if ("t", level) not in self._pressure_level_fields:
+            self._pressure_level_fields[("t", level)] = self.grb.get_t_pressure(
+                level
+            )[:]
+        return self._pressure_level_fields[("t", level)]
+
+    def _q_pressure(self, level: int) -> np.ndarray:
+        if ("q", level) not in self._pressure_level_fields:
+            self._pressure_level_fields[("q", level)] = self.grb.get_q_pressure(
+                level
+            )[:]
+        return self._pressure_level_fields[("q", level)]
+
+    def read_parameter(self, parameter: str) -> np.ndarray:
+        """read in the required parameter on the current projection"""
 
         values = None
 
@@ -90,7 +140,7 @@ class Era5:
             "t950",
             "t1000",
         ]:
-            values = self.grb.get_t_pressure(PressureLevels[parameter.upper()].value)[:]
+            values = self._t_pressure(PressureLevels[parameter.upper()].value)
         elif parameter in [
             "rh100",
             "rh250",
@@ -102,8 +152,8 @@ class Era5:
             "rh950",
             "rh1000",
         ]:
-            q = self.grb.get_q_pressure(PressureLevels[parameter.upper()].value)[:]
-            t = self.grb.get_t_pressure(PressureLevels[parameter.upper()].value)[:]
+            q = self._q_pressure(PressureLevels[parameter.upper()].value)
+            t = self._t_pressure(PressureLevels[parameter.upper()].value)
             values = sph2rh(q, t, PressureLevels[parameter.upper()].value)
         elif parameter in [
             "q100",
@@ -116,7 +166,7 @@ class Era5:
             "q950",
             "q1000",
         ]:
-            values = self.grb.get_q_pressure(PressureLevels[parameter.upper()].value)[:]
+            values = self._q_pressure(PressureLevels[parameter.upper()].value)
         elif parameter == "snow_mask":
             values = self.grb.get_snow_depth()[:]
         elif parameter == "t_land":
@@ -1,12 +1,12 @@
 import os
 from pathlib import Path
-from typing import Tuple
+from typing import Tuple, Union
 from dataclasses import dataclass
 import numpy as np
 from satpy import Scene
 import xarray as xr
 import re
-from cbase.utils.utils import datetime64_to_datetime
+from cbase.utils.cache import file_identity
 
 VGAC_PPS_PATH = "/nobackup/smhid20/proj/safcm/work/PPS/PPS2021_3_CLARA_VGAC/CALIPSO_matchups/SNPP/VIIRS/export/"
 
@@ -32,6 +32,29 @@ VGAC_PARAMETER_LIST = [
     "M15",
     "M16",
 ]
+VGAC_CHANNELS = [f"M{channel:02d}" for channel in range(1, 17)]
+# L1C image variables of the VIIRS channels in VGAC PPS files
+PPS_IMAGE_VARIABLES = {
+    "M01": "image20",
+    "M02": "image21",
+    "M03": "image22",
+    "M04": "image23",
+    "M05": "image1",
+    "M06": "image24",
+    "M07": "image2",
+    "M08": "image25",
+    "M09": "image8",
+    "M10": "image6",
+    "M11": "image9",
+    "M12": "image5",
+    "M13": "image26",
+    "M14": "image7",
+    "M15": "image3",
+    "M16": "image4",
+    "satzenith": "satzenith",
+    "satazimuth": "satazimuth",
+    "sunzenith": "sunzenith",
+}
 
 
 @dataclass
@@ -42,7 +65,7 @@ class VGACData:
 
     latitude: np.ndarray
     longitude: np.ndarray
-    time: np.ndarray
+    time: np.ndarray  # per scanline
     M01: np.ndarray
     M02: np.ndarray
     M03: np.ndarray
@@ -60,36 +83,46 @@ class VGACData:
     M15: np.ndarray
     M16: np.ndarray
     name: str
+    scanline_offset: int = 0  # first scanline of the granule that was read
+    source_files: tuple = ()  # file_identity of the L1C file
+
+    @property
+    def pixel_time(self) -> np.ndarray:
+        """time of each pixel, a read-only broadcast view of the scanline time"""
+        return np.broadcast_to(self.time[:, np.newaxis], self.latitude.shape)
 
     @classmethod
-    def from_file(cls, filepath: Path):
-        """alternative constructor from file"""
+    def from_file(
+        cls,
+        filepath: Path,
+        parameters: Union[list[str], None] = None,
+        scanlines: Union[tuple[int, int], None] = None,
+    ):
+        """
+        alternative constructor from file. Only the channels in parameters
+        (default all) are loaded, the others are None, and with scanlines
+        only the scanlines in [start, end). Geolocation and time are read,
+        the channels are dask arrays that are only read when cropped
+        """
+        rows = scanline_slice(scanlines)
+        channels = [
+            channel
+            for channel in VGAC_CHANNELS
+            if parameters is None or channel in parameters
+        ]
         scn = Scene(reader="viirs_vgac_l1c_nc", filenames=[filepath])
-        scn.load(VGAC_PARAMETER_LIST)
-        d = scn.to_xarray()
-        time_scanline = datetime64_to_datetime(d.scanline_timestamps.values)
-        time = np.tile(time_scanline, (d.latitude.values.shape[1], 1)).T
+        scn.load(["latitude", "longitude", "scanline_timestamps"] + channels)
         return cls(
-            d.latitude.values,
-            d.longitude.values % 360,
-            time,
-            d.M01.values,
-            d.M02.values,
-            d.M03.values,
-            d.M04.values,
-            d.M05.values,
-            d.M06.values,
-            d.M07.values,
-            d.M08.values,
-            d.M09.values,
-            d.M10.values,
-            d.M11.values,
-            d.M12.values,
-            d.M13.values,
-            d.M14.values,
-            d.M15.values,
-            d.M16.values,
+            scn["latitude"][rows].values,
+            scn["longitude"][rows].values % 360,
+            scn["scanline_timestamps"][rows].values.astype("datetime64[ns]"),
+            *[
+                scn[channel].data[rows] if channel in channels else None
+                for channel in VGAC_CHANNELS
+            ],
             os.path.basename(filepath),
+            rows.start or 0,
+            (file_identity(filepath),),
         )
 
 
@@ -101,7 +134,7 @@ class VGACPPSData:
 
     longitude: np.ndarray
     latitude: np.ndarray
-    time: np.ndarray
+    time: np.ndarray  # per scanline
     validation_height_base: np.ndarray
     M01: np.ndarray
     M02: np.ndarray
@@ -140,62 +173,133 @@ class VGACPPSData:
     cmic_quality: np.ndarray
     elevation: np.ndarray
     land_use: np.ndarray
+    name: str
+    scanline_offset: int = 0  # first scanline of the granule that was read
+    source_files: tuple = ()  # file_identity of the L1C file
+
+    @property
+    def pixel_time(self) -> np.ndarray:
+        """time of each pixel, a read-only broadcast view of the scanline time"""
+        return np.broadcast_to(self.time[:, np.newaxis], self.latitude.shape)
 
     @classmethod
-    def from_file(cls, filepath: Path):
-        """read data from netCDF file"""
-        with xr.open_dataset(filepath) as da:
-            validation_height_base = -999.9 * np.ones_like(da.lat.values)
-            time_scanline = datetime64_to_datetime(da.scanline_timestamps.values)
-            time = np.tile(time_scanline, (da.lat.shape[1], 1)).T
-        pps_data = get_pps_data(filepath)
+    def from_file(
+        cls,
+        filepath: Path,
+        parameters: Union[list[str], None] = None,
+        scanlines: Union[tuple[int, int], None] = None,
+    ):
+        """
+        read data from netCDF file. Only the channels and angles in
+        parameters (default all) are loaded, the others are None, and with
+        scanlines only the scanlines in [start, end). The channels and
+        angles are dask arrays that are only read when cropped
+        """
+        rows = scanline_slice(scanlines)
+        # the dask arrays of the images reopen the file when they are read
+        with xr.open_dataset(filepath, chunks={}) as da:
+            latitude = da.lat[rows].values
+            longitude = da.lon[rows].values % 360
+            scanline_time = da.scanline_timestamps[rows].values
+            images = {
+                parameter: da[variable].data[0, rows]
+                if parameters is None or parameter in parameters
+                else None
+                for parameter, variable in PPS_IMAGE_VARIABLES.items()
+            }
+        pps_data = get_pps_data(filepath, scanlines)
         vgac = VGACPPSData(
-            da.lon.values % 360,
-            da.lat.values,
-            time,
-            validation_height_base,
-            da.image20.values[0, :, :],  # M01
-            da.image21.values[0, :, :],  # M02
-            da.image22.values[0, :, :],  # M03
-            da.image23.values[0, :, :],  # M04
-            da.image1.values[0, :, :],  # M05
-            da.image24.values[0, :, :],  # M06
-            da.image2.values[0, :, :],  # M07
-            da.image25.values[0, :, :],  # M08
-            da.image8.values[0, :, :],  # M09
-            da.image6.values[0, :, :],  # M10
-            da.image9.values[0, :, :],  # M11
-            da.image5.values[0, :, :],  # M12
-            da.image26.values[0, :, :],  # M13
-            da.image7.values[0, :, :],  # M14
-            da.image3.values[0, :, :],  # M15
-            da.image4.values[0, :, :],  # M16
-            da.satzenith.values[0, :, :],
-            da.satazimuth.values[0, :, :],
-            da.sunzenith.values[0, :, :],
-            extract_pps_parameter(pps_data, "ctth_pres"),
-            extract_pps_parameter(pps_data, "ctth_alti"),
-            extract_pps_parameter(pps_data, "ctth_tempe"),
-            extract_pps_parameter(pps_data, "ctth_quality"),
-            extract_pps_parameter(pps_data, "ctth16_pres"),
-            extract_pps_parameter(pps_data, "ctth16_alti"),
-            extract_pps_parameter(pps_data, "ctth16_tempe"),
-            extract_pps_parameter(pps_data, "ctth84_pres"),
-            extract_pps_parameter(pps_data, "ctth84_alti"),
-            extract_pps_parameter(pps_data, "ctth84_tempe"),
-            extract_pps_parameter(pps_data, "ct"),
-            extract_pps_parameter(pps_data, "ct_quality"),
-            extract_pps_parameter(pps_data, "cmic_phase"),
-            extract_pps_parameter(pps_data, "cmic_lwp"),
-            extract_pps_parameter(pps_data, "cmic_cot"),
-            extract_pps_parameter(pps_data, "cmic_quality"),
-            extract_pps_parameter(pps_data, "elevation"),
-            extract_pps_parameter(pps_data, "land_use"),
+            longitude,
+            latitude,
+            scanline_time.astype("datetime64[ns]"),
+            -999.9 * np.ones_like(latitude),  # validation_height_base
+            **images,
+            ctp=extract_pps_parameter(pps_data, "ctth_pres"),
+            cth=extract_pps_parameter(pps_data, "ctth_alti"),
+            ctt=extract_pps_parameter(pps_data, "ctth_tempe"),
+            ctp_quality=extract_pps_parameter(pps_data, "ctth_quality"),
+            ctp16=extract_pps_parameter(pps_data, "ctth16_pres"),
+            cth16=extract_pps_parameter(pps_data, "ctth16_alti"),
+            ctt16=extract_pps_parameter(pps_data, "ctth16_tempe"),
+            ctp84=extract_pps_parameter(pps_data, "ctth84_pres"),
+            cth84=extract_pps_parameter(pps_data, "ctth84_alti"),
+            ctt84=extract_pps_parameter(pps_data, "ctth84_tempe"),
+            ct=extract_pps_parameter(pps_data, "ct"),
+            ct_quality=extract_pps_parameter(pps_data, "ct_quality"),
+            cmic_phase=extract_pps_parameter(pps_data, "cmic_phase"),
+            cmic_lwp=extract_pps_parameter(pps_data, "cmic_lwp"),
+            cmic_cot=extract_pps_parameter(pps_data, "cmic_cot"),
+            cmic_quality=extract_pps_parameter(pps_data, "cmic_quality"),
+            elevation=extract_pps_parameter(pps_data, "elevation"),
+            land_use=extract_pps_parameter(pps_data, "land_use"),
+            name=os.path.basename(filepath),
+            scanline_offset=rows.start or 0,
+            source_files=(file_identity(filepath),),
         )
         return vgac
 
 
-def get_pps_data(input_path: Path) -> dict:
+def scanline_slice(scanlines: Union[tuple[int, int], None]) -> slice:
+    """slice of the scanlines [start, end), all scanlines if None"""
+    if scanlines is None:
+        return slice(None)
+    return slice(*scanlines)
+
+
+def read_vgac_geolocation(filepath: Path) -> dict:
+    """read only lat/lon and scanline time of a VGAC or VGAC PPS L1C file"""
+    if os.path.basename(filepath)[:4] == "VGAC":
+        scn = Scene(reader="viirs_vgac_l1c_nc", filenames=[filepath])
+        scn.load(["latitude", "longitude", "scanline_timestamps"])
+        latitude = scn["latitude"].values
+        longitude = scn["longitude"].values
+        scanline_time = scn["scanline_timestamps"].values
+    else:
+        with xr.open_dataset(filepath) as da:
+            latitude = da.lat.values
+            longitude = da.lon.values
+            scanline_time = da.scanline_timestamps.values
+    return {
+        "latitude": latitude,
+        "longitude": longitude % 360,
+        "time": scanline_time.astype("datetime64[ns]"),
+    }
+
+
+# PPS product variables read per file, keyed by the name in pps_data
+PPS_PRODUCT_VARIABLES = {
+    "ctth": {
+        "ctth_pres": "ctth_pres",
+        "ctth_tempe": "ctth_tempe",
+        "ctth_quality": "ctth_quality",
+        "ctth_alti": "ctth_alti",
+    },
+    "ctth16": {
+        "ctth16_pres": "ctth_pres",
+        "ctth16_tempe": "ctth_tempe",
+        "ctth16_alti": "ctth_alti",
+    },
+    "ctth84": {
+        "ctth84_pres": "ctth_pres",
+        "ctth84_tempe": "ctth_tempe",
+        "ctth84_alti": "ctth_alti",
+    },
+    "ct": {"ct": "ct", "ct_quality": "ct_quality"},
+    "cmic": {
+        "cmic_phase": "cmic_phase",
+        "cmic_cot": "cmic_cot",
+        "cmic_lwp": "cmic_lwp",
+        "cmic_quality": "cmic_quality",
+    },
+    "aux": {"elevation": "elevation", "land_use": "landuse"},
+}
+
+
+def get_pps_data(
+    input_path: Path, scanlines: Union[tuple[int, int], None] = None
+) -> dict:
+    """read the PPS products of a L1C file, only the scanlines in
+    [start, end) if scanlines is given"""
     (
         output_path,
         aux_path,
@@ -206,44 +310,37 @@ def get_pps_data(input_path: Path) -> dict:
         cmic_filename,
         aux_filename,
     ) = get_pps_data_files(input_path)
+    product_files = {
+        "ctth": os.path.join(output_path, ctth_filename),
+        "ctth16": os.path.join(output_path, ctth16_filename),
+        "ctth84": os.path.join(output_path, ctth84_filename),
+        "ct": os.path.join(output_path, ct_filename),
+        "cmic": os.path.join(output_path, cmic_filename),
+        "aux": os.path.join(aux_path, aux_filename),
+    }
     pps_data = {}
-    print(
-        output_path,
-        aux_path,
-        ctth_filename,
-        ctth16_filename,
-        ctth84_filename,
-        ct_filename,
-        cmic_filename,
-        aux_filename,
-    )
-    with xr.open_dataset(os.path.join(output_path, ctth_filename)) as da:
-        pps_data["ctth_pres"] = da.ctth_pres.values[0, :, :]
-        pps_data["ctth_tempe"] = da.ctth_tempe.values[0, :, :]
-        pps_data["ctth_quality"] = da.ctth_quality.values[0, :, :]
-        pps_data["ctth_alti"] = da.ctth_alti.values[0, :, :]
-    with xr.open_dataset(os.path.join(output_path, ctth16_filename)) as da:
-        pps_data["ctth16_pres"] = da.ctth_pres.values[0, :, :]
-        pps_data["ctth16_tempe"] = da.ctth_tempe.values[0, :, :]
-        pps_data["ctth16_alti"] = da.ctth_alti.values[0, :, :]
-    with xr.open_dataset(os.path.join(output_path, ctth84_filename)) as da:
-        pps_data["ctth84_pres"] = da.ctth_pres.values[0, :, :]
-        pps_data["ctth84_tempe"] = da.ctth_tempe.values[0, :, :]
-        pps_data["ctth84_alti"] = da.ctth_alti.values[0, :, :]
-    with xr.open_dataset(os.path.join(output_path, ct_filename)) as da:
-        pps_data["ct"] = da.ct.values[0, :, :]
-        pps_data["ct_quality"] = da.ct_quality.values[0, :, :]
-    with xr.open_dataset(os.path.join(output_path, cmic_filename)) as da:
-        pps_data["cmic_phase"] = da.cmic_phase.values[0, :, :]
-        pps_data["cmic_cot"] = da.cmic_cot.values[0, :, :]
-        pps_data["cmic_lwp"] = da.cmic_lwp.values[0, :, :]
-        pps_data["cmic_quality"] = da.cmic_quality.values[0, :, :]
-    with xr.open_dataset(os.path.join(aux_path, aux_filename)) as da:
-        pps_data["elevation"] = da.elevation.values[0, :, :]
-        pps_data["land_use"] = da.landuse[0, :, :]
+    for product, filename in product_files.items():
+        pps_data.update(
+            read_pps_file(filename, PPS_PRODUCT_VARIABLES[product], scanlines)
+        )
     return pps_data
 
 
+def read_pps_file(
+    filename: str,
+    variables: dict[str, str],
+    scanlines: Union[tuple[int, int], None] = None,
+) -> dict:
+    """read the variables ({name: variable in file}) of the first time step
+    of a PPS product file"""
+    rows = scanline_slice(scanlines)
+    with xr.open_dataset(filename) as da:
+        data = {
+            name: da[variable][0, rows].values for name, variable in variables.items()
+        }
+    return data
+
+
 def extract_pps_parameter(pps_data, parameter) -> np.ndarray:
     try:
         return pps_data[parameter]
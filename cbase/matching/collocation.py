@@ -0,0 +1,219 @@
+from dataclasses import dataclass
+from typing import Sequence, Union
+import numpy as np
+import numpy.typing as npt
+from scipy.spatial import cKDTree
+from cbase.utils.distance import lonlat2xyz, km2chord, chord2km
+
+
+@dataclass
+class MatchPairs:
+    """pairs of VGAC pixels and Cloudsat profiles within the search radius"""
+
+    pixel: np.ndarray  # flat index of the queried VGAC pixel
+    profile: np.ndarray  # index of the Cloudsat profile along the track
+    distance: np.ndarray  # great circle distance in km
+    time_diff: Union[np.ndarray, None] = None  # absolute time difference, minutes
+
+    def __len__(self) -> int:
+        return len(self.pixel)
+
+    def select(self, mask: np.ndarray) -> "MatchPairs":
+        """subset of the pairs given by a boolean mask or index array"""
+        return MatchPairs(
+            self.pixel[mask],
+            self.profile[mask],
+            self.distance[mask],
+            None if self.time_diff is None else self.time_diff[mask],
+        )
+
+
+class CollocationIndex:
+    """
+    KD-tree over the Cloudsat track on the unit sphere, built once per granule.
+    Radius queries are done as chord length comparisons and scale with the
+    number of matches rather than with the size of track times swath
+    """
+
+    def __init__(self, latitude: np.ndarray, longitude: np.ndarray):
+        self.xyz = lonlat2xyz(longitude, latitude).reshape(-1, 3)
+        self.tree = cKDTree(self.xyz)
+
+    def query_radius(
+        self, latitude: np.ndarray, longitude: np.ndarray, radius: float
+    ) -> MatchPairs:
+        """
+        find all Cloudsat profiles within radius (km) of each queried pixel,
+        pixels are flattened in C order
+        """
+        xyz = lonlat2xyz(longitude, latitude).reshape(-1, 3)
+        chord = km2chord(radius)
+        # cheap nearest neighbour pass to keep only pixels close to the track,
+        # pixels with missing geolocation are left out
+        valid = np.flatnonzero(np.all(np.isfinite(xyz), axis=1))
+        distance, _ = self.tree.query(
+            xyz[valid], k=1, distance_upper_bound=np.nextafter(chord, np.inf)
+        )
+        candidates = valid[np.isfinite(distance)]
+        if len(candidates) == 0:
+            return MatchPairs(
+                np.array([], dtype=np.intp),
+                np.array([], dtype=np.intp),
+                np.array([], dtype=float),
+            )
+
+        pairs = self.tree.sparse_distance_matrix(
+            cKDTree(xyz[candidates]), chord, output_type="ndarray"
+        )
+        return MatchPairs(
+            candidates[pairs["j"]],
+            pairs["i"].astype(np.intp),
+            chord2km(pairs["v"]),
+        )
+
+
+class CollocatedData:
+    """
+    matched Cloudsat parameters of a VGAC granule, stored sparse: for each
+    parameter only the flat index of the pixels with a collocation and their
+    values. Dense arrays, filled with the fill value of the parameter, are
+    made for crops only
+    """
+
+    def __init__(
+        self,
+        shape: tuple[int, int],
+        parameters: Sequence[str] = (),
+        fill_value: float = -999.9,
+        dtype: npt.DTypeLike = np.float64,
+    ):
+        self.shape = tuple(shape)
+        self.fill_values: dict[str, float] = {}
+        self.dtypes: dict[str, np.dtype] = {}
+        self._pixel: dict[str, np.ndarray] = {}
+        self._values: dict[str, np.ndarray] = {}
+        # (pixel, values) set since the last merge
+        self._pending: dict[str, list[tuple[np.ndarray, np.ndarray]]] = {}
+        for name in parameters:
+            self.add_parameter(name, fill_value, dtype)
+
+    def add_parameter(self, name: str, fill_value: float, dtype: npt.DTypeLike):
+        """new parameter without any collocated pixels"""
+        self.fill_values[name] = fill_value
+        self.dtypes[name] = np.dtype(dtype)
+        self._pixel[name] = np.array([], dtype=np.int64)
+        self._values[name] = np.array([], dtype=dtype)
+        self._pending[name] = []
+
+    def __iter__(self):
+        return iter(self.fill_values)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.fill_values
+
+    def keys(self):
+        return self.fill_values.keys()
+
+    def set(self, row: np.ndarray, col: np.ndarray, values: dict[str, np.ndarray]):
+        """set parameter values of pixels, replacing earlier values"""
+        pixel = np.ravel_multi_index(
+            (np.asarray(row), np.asarray(col)), self.shape
+        ).astype(np.int64)
+        for name, data in values.items():
+            data = np.asarray(data, dtype=self.dtypes[name])
+            self._pending[name].append((pixel, np.broadcast_to(data, pixel.shape)))
+
+    def sparse(self, name: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """row, column and value of the collocated pixels, sorted by pixel"""
+        self._merge(name)
+        row, col = np.unravel_index(self._pixel[name], self.shape)
+        return row, col, self._values[name]
+
+    def densify(
+        self,
+        name: str,
+        crop: tuple[slice, slice] = (slice(None), slice(None)),
+    ) -> np.ndarray:
+        """dense array of a parameter, for the whole granule or a crop"""
+        self._merge(name)
+        i1, i2, _ = crop[0].indices(self.shape[0])
+        j1, j2, _ = crop[1].indices(self.shape[1])
+        dense = np.full((i2 - i1, j2 - j1), self.fill_values[name], self.dtypes[name])
+        pixel = self._pixel[name]
+        start, end = np.searchsorted(pixel, [i1 * self.shape[1], i2 * self.shape[1]])
+        row, col = np.unravel_index(pixel[start:end], self.shape)
+        inside = (col >= j1) & (col < j2)
+        values = self._values[name][start:end]
+        dense[row[inside] - i1, col[inside] - j1] = values[inside]
+        return dense
+
+    def _merge(self, name: str):
+        """merge values set since the last merge, the last value of a pixel
+        is kept"""
+        if len(self._pending[name]) == 0:
+            return
+        pixel = np.concatenate(
+            [self._pixel[name]] + [pixel for pixel, _ in self._pending[name]]
+        )
+        values = np.concatenate(
+            [self._values[name]] + [values for _, values in self._pending[name]]
+        )
+        self._pending[name] = []
+        # unique on the reversed arrays finds the last occurrence of each pixel
+        self._pixel[name], last = np.unique(pixel[::-1], return_index=True)
+        self._values[name] = values[::-1][last]
+
+
+def nearest_per_pixel(
+    pairs: MatchPairs, distance: Union[np.ndarray, None] = None
+) -> MatchPairs:
+    """keep only the closest Cloudsat profile for each matched pixel, by
+    pairs.distance or by another distance per pair"""
+    distance = pairs.distance if distance is None else distance
+    order = np.lexsort((distance, pairs.pixel))
+    _, first = np.unique(pairs.pixel[order], return_index=True)
+    return pairs.select(order[first])
+
+
+def aggregate_pairs(
+    pixel: np.ndarray, values: dict[str, np.ndarray], fill_value: float = -999.9
+) -> tuple[np.ndarray, np.ndarray, dict[str, dict[str, np.ndarray]]]:
+    """
+    mean, std, min, max and number of valid Cloudsat values matched to each
+    pixel, computed for all parameters in one scatter pass over the pairs.
+    Fill values are not counted, pixels without valid values get fill_value.
+    Returns the unique matched pixels, the number of matched Cloudsat
+    profiles of each pixel, including clear sky profiles, and the statistics
+    per parameter
+    """
+    pixels, inverse = np.unique(pixel, return_inverse=True)
+    npixels = len(pixels)
+    pair_count = np.bincount(inverse, minlength=npixels)
+    statistics = {}
+    for key, pair_values in values.items():
+        pair_values = np.asarray(pair_values, dtype=float)
+        valid = np.isfinite(pair_values) & (pair_values != fill_value)
+        index, data = inverse[valid], pair_values[valid]
+
+        count = np.bincount(index, minlength=npixels)
+        total = np.bincount(index, weights=data, minlength=npixels)
+        total_squared = np.bincount(index, weights=data**2, minlength=npixels)
+        minimum = np.full(npixels, np.inf)
+        np.minimum.at(minimum, index, data)
+        maximum = np.full(npixels, -np.inf)
+        np.maximum.at(maximum, index, data)
+
+        has_data = count > 0
+        mean = np.divide(total, count, out=np.zeros(npixels), where=has_data)
+        variance = np.divide(
+            total_squared, count, out=np.zeros(npixels), where=has_data
+        )
+        std = np.sqrt(np.maximum(variance - mean**2, 0))
+        statistics[key] = {
+            "mean": np.where(has_data, mean, fill_value),
+            "std": np.where(has_data, std, fill_value),
+            "min": np.where(has_data, minimum, fill_value),
+            "max": np.where(has_data, maximum, fill_value),
+            "count": count,
+        }
+    return pixels, pair_count, statistics
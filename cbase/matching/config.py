@@ -12,6 +12,7 @@ VGAC_PATH = "/home/a002602/data/cloud_base/vgac/"
 NWP_PATH = "/home/a002602/data/cloud_base/NWP/"
 ATMS_PATH = "/nobackup/smhid17/proj/foua/data/satellit/ATMS/"
 OUTPUT_PATH = "/nobackup/smhid20/users/sm_indka/collocated_data/VGAC_PPS/with_cbp_new/"
+CACHE_PATH = "/nobackup/smhid20/users/sm_indka/collocated_data/cache/"
 
 CNN_NWP_PARAMETERS = [
     "h_2meter",
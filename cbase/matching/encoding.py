@@ -0,0 +1,79 @@
+from dataclasses import dataclass, field
+from typing import Any, Union
+import numpy as np
+from .config import XIMAGE_SIZE, YIMAGE_SIZE
+
+INT16_FILL_VALUE = np.iinfo(np.int16).min
+
+# scale_factor and add_offset of parameters stored as int16
+PACKED_PARAMETERS = {
+    **{f"M{channel:02d}": (0.01, 0.0) for channel in range(1, 12)},  # reflectances
+    **{f"M{channel:02d}": (0.01, 250.0) for channel in range(12, 17)},  # BTs
+    "ct": (1.0, 0.0),
+    "cmic_phase": (1.0, 0.0),
+    "land_use": (1.0, 0.0),
+}
+
+
+@dataclass
+class EncodingProfile:
+    """
+    how CNN scenes are stored on disk: one chunk per scene, compression
+    (zlib, or zstd if the netCDF library has the plugin), float parameters
+    as dtype and the packed parameters as int16 with scale_factor/add_offset.
+    EncodingProfile(compression=None, dtype="float64", packed={}) gives the
+    old uncompressed files
+    """
+
+    compression: Union[str, None] = "zlib"
+    complevel: int = 4
+    shuffle: bool = True
+    dtype: str = "float32"
+    packed: dict[str, tuple[float, float]] = field(
+        default_factory=lambda: dict(PACKED_PARAMETERS)
+    )
+    keep_dtype: tuple[str, ...] = ("time",)  # epoch seconds need float64
+
+    def variable_encoding(self, parameter: str, dtype: np.dtype) -> dict[str, Any]:
+        """xarray/netCDF encoding of one (nscene, npix, nscan) parameter"""
+        encoding: dict[str, Any] = {"chunksizes": (1, YIMAGE_SIZE, XIMAGE_SIZE)}
+        if self.compression is not None:
+            encoding["compression"] = self.compression
+            encoding["complevel"] = self.complevel
+            encoding["shuffle"] = self.shuffle
+        if parameter in self.packed:
+            scale_factor, add_offset = self.packed[parameter]
+            encoding["dtype"] = "int16"
+            encoding["_FillValue"] = INT16_FILL_VALUE
+            if (scale_factor, add_offset) != (1.0, 0.0):
+                encoding["scale_factor"] = scale_factor
+                encoding["add_offset"] = add_offset
+        elif np.dtype(dtype).kind == "f" and parameter not in self.keep_dtype:
+            encoding["dtype"] = self.dtype
+        return encoding
+
+
+def pack_int16(
+    values: np.ndarray, scale_factor: float = 1.0, add_offset: float = 0.0
+) -> np.ndarray:
+    """round (values - add_offset) / scale_factor to int16, missing and out
+    of range values get INT16_FILL_VALUE"""
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(invalid="ignore"):
+        packed = np.round((values - add_offset) / scale_factor)
+        invalid = (
+            ~np.isfinite(packed)
+            | (packed <= INT16_FILL_VALUE)
+            | (packed > np.iinfo(np.int16).max)
+        )
+    packed[invalid] = INT16_FILL_VALUE
+    return packed.astype(np.int16)
+
+
+def mask_unpackable(
+    values: np.ndarray, scale_factor: float = 1.0, add_offset: float = 0.0
+) -> np.ndarray:
+    """values that cannot be packed to int16 set to NaN, for writers that
+    do the packing themselves"""
+    packed = pack_int16(values, scale_factor, add_offset)
+    return np.where(packed == INT16_FILL_VALUE, np.nan, values)
@@ -0,0 +1,67 @@
+from typing import Union
+import numpy as np
+from .collocation import CollocationIndex
+from .config import COLLOCATION_THRESHOLD, TIME_DIFF_ALLOWED, YIMAGE_SIZE
+
+
+def footprints_overlap(cloudsat: dict, vgac: dict) -> bool:
+    """
+    check if the Cloudsat track crosses the VGAC swath within
+    COLLOCATION_THRESHOLD and TIME_DIFF_ALLOWED, using only the
+    latitude/longitude/time of the Cloudsat profiles and VGAC scanlines
+    """
+    allowed = TIME_DIFF_ALLOWED * np.timedelta64(1, "m")
+    cloudsat_time = cloudsat["time"]
+    scan_time = vgac["time"]
+
+    # scanlines and profiles within the time range of the other pass
+    scans = scans_within_time(cloudsat_time, scan_time)
+    if len(scans) == 0:
+        return False
+    profiles = np.flatnonzero(
+        (cloudsat_time >= scan_time[scans].min() - allowed)
+        & (cloudsat_time <= scan_time[scans].max() + allowed)
+    )
+    if len(profiles) == 0:
+        return False
+
+    index = CollocationIndex(
+        cloudsat["latitude"][profiles], cloudsat["longitude"][profiles]
+    )
+    pairs = index.query_radius(
+        vgac["latitude"][scans], vgac["longitude"][scans], COLLOCATION_THRESHOLD
+    )
+    row = pairs.pixel // vgac["latitude"].shape[1]
+    tdiff = np.abs(cloudsat_time[profiles][pairs.profile] - scan_time[scans][row])
+    return bool(np.any(tdiff <= allowed))
+
+
+def scans_within_time(cloudsat_time: np.ndarray, scan_time: np.ndarray) -> np.ndarray:
+    """index of the scanlines within TIME_DIFF_ALLOWED of the Cloudsat pass"""
+    allowed = TIME_DIFF_ALLOWED * np.timedelta64(1, "m")
+    valid_profiles = ~np.isnat(cloudsat_time)
+    if not np.any(valid_profiles):
+        return np.array([], dtype=int)
+    return np.flatnonzero(
+        (scan_time >= cloudsat_time[valid_profiles].min() - allowed)
+        & (scan_time <= cloudsat_time[valid_profiles].max() + allowed)
+    )
+
+
+def collocation_scanlines(
+    cloudsat_time: np.ndarray, scan_time: np.ndarray
+) -> Union[tuple[int, int], None]:
+    """
+    [start, end) of the scanlines that can have collocations with the
+    Cloudsat pass, with YIMAGE_SIZE / 2 extra scanlines on both sides so
+    that all CNN scenes around the collocations fit. None if no scanline
+    is within TIME_DIFF_ALLOWED
+    """
+    scans = scans_within_time(cloudsat_time, scan_time)
+    if len(scans) == 0:
+        return None
+    padding = YIMAGE_SIZE // 2
+    return (
+        max(int(scans.min()) - padding, 0),
+        min(int(scans.max()) + 1 + padding, len(scan_time)),
+    )
@@ -1,10 +1,10 @@
 import numpy as np
-import xarray as xr
 from xarray import Dataset
 from tqdm import tqdm
 from typing import List, Tuple, Dict
 import logging
 from scipy.ndimage import uniform_filter
+from .scene_writer import iter_scenes
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -294,7 +294,8 @@ def find_variance_in_neigh(ds: Dataset, do_atms: bool) -> Dict[str, float]:
 def make_pixel_dataset(
     input_files: List[str], do_atms: bool = False
 ) -> Dict[str, Dict[str, np.ndarray]]:
-    """make xr dataset with all input parameters in keys"""
+    """make xr dataset with all input parameters in keys, input files are
+    cnn_data netCDF files or Zarr stores with one or more scenes"""
     parameter_names = VGAC_KEYS + VGAC_PPS_KEYS
     parameter_neighbourhood = VGAC_KEYS_NEIGHBOURHOOD
     if do_atms:
@@ -305,7 +306,7 @@ def make_pixel_dataset(
         training_data[key] = []
 
     for input_file in tqdm(input_files[:]):
-        with xr.open_dataset(input_file) as ds:
+        for ds in iter_scenes(input_file):
             mask = ds.cloud_base.values > 0
             for key in parameter_names:
                 try:
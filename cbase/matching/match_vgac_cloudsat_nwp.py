@@ -1,14 +1,25 @@
 import os
 from dataclasses import dataclass
-from datetime import timedelta
 from typing import Union
 import numpy as np
 import xarray as xr
-from scipy.interpolate import griddata, interp1d
+from scipy.spatial import cKDTree
 from pps_nwp.gribfile import GRIBFile
 from cbase.data_readers.viirs import VGACData, VGACPPSData
 from cbase.data_readers.cloudsat import CloudsatData
-from cbase.utils.utils import haversine_distance
+from cbase.utils.utils import datetime_to_datetime64
+from cbase.utils.distance import chord_squared, lonlat2xyz
+from cbase.utils.interpolation import interpolate_columns
+from cbase.utils.cache import cache_key, load_npz_cache, save_npz_cache
+from .collocation import (
+    CollocatedData,
+    CollocationIndex,
+    MatchPairs,
+    aggregate_pairs,
+    nearest_per_pixel,
+)
+from .encoding import EncodingProfile, mask_unpackable
+from .scene_writer import SCENE_WRITERS
 from .config import (
     COLLOCATION_THRESHOLD,
     TIME_WINDOW,
@@ -19,11 +30,14 @@ from .config import (
     CNN_VGAC_PPS_PARAMETERS,
     CNN_MATCHED_PARAMETERS,
     TIME_DIFF_ALLOWED,
-    SECS_PER_MINUTE,
     OUTPUT_PATH,
+    I1,
+    I2,
 )
 
 FILL_VALUE = -9
+MATCH_PAIRS_CACHE_VERSION = 2
+TRACK_SEGMENT_HALF_WIDTH = 1.5  # degrees
 
 
 @dataclass
@@ -45,10 +59,15 @@ class DataMatcher:
         cloudsat: CloudsatData,
         vgac: list[VGACData | VGACPPSData],
         era5: GRIBFile,
+        cache_path: Union[str, None] = None,
     ):
         self.cloudsat = cloudsat
         self.vgac = vgac
         self.era5 = era5
+        self.cache_path = cache_path
+        self._match_pairs = None
+        self._track_segments = None
+        self._collocation_index = None
 
         if not self.check_overlapping_time():
             raise ValueError("The two passes are not at same time")
@@ -57,13 +76,29 @@ class DataMatcher:
             OUTPUT_PATH, f"cnn_data_{self.cloudsat.name[:22]}_VGAC.nc"
         )
         self.collocated_data = self.initialize_collocated_data()
-
-    def initialize_collocated_data(self) -> dict:
-        """Initialize the collocated data dictionary"""
-        collocated_dict = {}
-        for key in CNN_MATCHED_PARAMETERS:
-            collocated_dict[key] = np.ones_like(self.vgac.latitude) * -999.9
-        return collocated_dict
+        # sorted datetime64 times, for binary search of time windows
+        self.cloudsat_time64 = datetime_to_datetime64(self.cloudsat.time)
+        self.scan_time64 = datetime_to_datetime64(self.vgac.time)
+
+    @property
+    def collocation_index(self) -> CollocationIndex:
+        """KD-tree index of the Cloudsat track, only built when the match
+        pairs are not read from the cache"""
+        if self._collocation_index is None:
+            self._collocation_index = CollocationIndex(
+                self.cloudsat.latitude, self.cloudsat.longitude
+            )
+        return self._collocation_index
+
+    def initialize_collocated_data(self) -> CollocatedData:
+        """Initialize the sparse collocated data, pixels without collocation
+        are -999.9 when densified"""
+        return CollocatedData(
+            self.vgac.latitude.shape,
+            CNN_MATCHED_PARAMETERS,
+            fill_value=-999.9,
+            dtype=self.vgac.latitude.dtype,
+        )
 
     def check_overlapping_time(self) -> bool:
         """
@@ -73,154 +108,308 @@ class DataMatcher:
         t2 = self.cloudsat.time[-1]  # end time
         if t1 > t2:
             raise ValueError("start time cannot be after end time")
-        for dt in self.vgac.time[:, 0]:
-            if t1 <= dt <= t2:
-                return True
-        return True
+        scan_times = self.vgac.time
+        return bool(np.any((scan_times >= t1) & (scan_times <= t2)))
 
-    def match_vgac_cloudsat(self):
+    def match_vgac_cloudsat(self, batched: bool = False, aggregate: bool = False):
         """
-        For each VGAC scan, matches from Cloudsat are found
+        For each VGAC scan, matches from Cloudsat are found,
+        with batched=True all scans are matched in one vectorized pass,
+        with aggregate=True statistics of all matched Cloudsat profiles
+        are added per VGAC pixel
         """
+        if batched:
+            self.match_vgac_cloudsat_batched()
+        else:
+            for itime in range(len(self.vgac.time)):
+                icld = self.get_index_closest_cloudsat_track(itime)
+                if icld is None:
+                    continue
+                icld1, icld2 = icld
 
-        for itime in range(len(self.vgac.time)):
-            if self.get_index_closest_cloudsat_track(itime) is None:
-                continue
-            icld1, icld2 = self.get_index_closest_cloudsat_track(itime)
+                if np.all(self.cloudsat.cloud_base[icld1:icld2] < 0):
+                    continue
+                # get the matching data for the selected part of swath
+                self.process_matching_iteration_nearest(itime, [icld1, icld2])
 
-            if np.all(self.cloudsat.cloud_base[icld1:icld2] < 0):
-                continue
-            # get the matching data for the selected part of swath
-            self.process_matching_iteration_nearest(itime, [icld1, icld2])
+        if aggregate:
+            self.aggregate_vgac_cloudsat()
 
-    def process_matching_iteration_nearest(self, i: int, icld: tuple[int, int]):
-        """the matching process is run for each VGAC scan,
-        Cloudsat pixels within radius given by COLLOCATION_THRESHOLD
-        are averaged to give the cloud base height at eligible pixels of
-        VGAC
+    def find_match_pairs(self) -> MatchPairs:
         """
+        all pairs of VGAC pixels (flat index) and Cloudsat profiles within
+        COLLOCATION_THRESHOLD and TIME_DIFF_ALLOWED, for the whole granule.
+        The pairs are computed once, and read from/written to the
+        collocation cache when a cache_path is given
+        """
+        if self._match_pairs is not None:
+            return self._match_pairs
+        cache_file = self.match_pairs_cache_file()
+        if cache_file is not None:
+            self._match_pairs = self._load_match_pairs(cache_file)
+        if self._match_pairs is None:
+            self._match_pairs = self._compute_match_pairs()
+            if cache_file is not None:
+                self._save_match_pairs(cache_file, self._match_pairs)
+        return self._match_pairs
+
+    def _compute_match_pairs(self) -> MatchPairs:
+        pairs = self.collocation_index.query_radius(
+            self.vgac.latitude, self.vgac.longitude, COLLOCATION_THRESHOLD
+        )
+        row, _ = np.unravel_index(pairs.pixel, self.vgac.latitude.shape)
+        pairs.time_diff = time_diff_minutes(
+            self.cloudsat_time64[pairs.profile], self.scan_time64[row]
+        )
+        pairs = pairs.select(pairs.time_diff <= TIME_DIFF_ALLOWED)
+        # sorted by pixel, so that the pairs of a scan are contiguous
+        return pairs.select(np.argsort(pairs.pixel, kind="stable"))
+
+    def match_pairs_cache_file(self) -> Union[str, None]:
+        """cache file of the match pairs, keyed by the identity of the input
+        files, the part of the granules that was read and the collocation
+        settings"""
+        if self.cache_path is None:
+            return None
+        key = cache_key(
+            MATCH_PAIRS_CACHE_VERSION,
+            self.cloudsat.name,
+            self.vgac.name,
+            self.cloudsat.source_files,
+            self.vgac.source_files,
+            self.vgac.latitude.shape,
+            self.vgac.scanline_offset,
+            len(self.cloudsat.latitude),
+            str(self.cloudsat_time64[0]),
+            str(self.scan_time64[0]),
+            COLLOCATION_THRESHOLD,
+            TIME_DIFF_ALLOWED,
+        )
+        return os.path.join(self.cache_path, f"match_pairs_{key}.npz")
+
+    def _load_match_pairs(self, cache_file: str) -> Union[MatchPairs, None]:
+        cache = load_npz_cache(cache_file)
+        if cache is None:
+            return None
+        return MatchPairs(
+            np.ravel_multi_index(
+                (cache["row"], cache["col"]), self.vgac.latitude.shape
+            ),
+            cache["profile"].astype(np.intp),
+            cache["distance"].astype(float),
+            cache["time_diff"].astype(float),
+        )
 
-        lon_c, lat_c, lon_v, lat_v = self.broadcast_arrays(i, icld)
-
-        distances = haversine_distance(lat_v, lon_v, lat_c, lon_c)
-        args = np.argwhere(distances <= COLLOCATION_THRESHOLD)
-        x_argmin, y_argmin = args[:, 0], args[:, 1]
-        if len(x_argmin) > 0:
-            # check tdiff between cloudsat and VGAC collocations
-            tdiff = np.abs(
-                self.cloudsat.time[icld[0] : icld[1]][x_argmin] - self.vgac.time[i, 0]
-            )
-            tdiff_minutes = np.abs(
-                np.array([t.seconds / SECS_PER_MINUTE for t in tdiff])
-            )
-            valid_indices = np.where(tdiff_minutes <= TIME_DIFF_ALLOWED)[0]
+    def _save_match_pairs(self, cache_file: str, pairs: MatchPairs):
+        row, col = np.unravel_index(pairs.pixel, self.vgac.latitude.shape)
+        save_npz_cache(
+            cache_file,
+            {
+                "row": row.astype(np.int32),
+                "col": col.astype(np.int32),
+                "profile": pairs.profile.astype(np.int32),
+                "distance": pairs.distance.astype(np.float32),
+                "time_diff": pairs.time_diff.astype(np.float32),
+            },
+        )
 
-            if len(valid_indices) > 0:
-                self._collocate_data(
-                    i, icld, x_argmin[valid_indices], y_argmin[valid_indices]
-                )
+    def scan_match_pairs(self, i: int) -> MatchPairs:
+        """match pairs of the VGAC scan i"""
+        pairs = self.find_match_pairs()
+        npix = self.vgac.latitude.shape[1]
+        start, end = np.searchsorted(pairs.pixel, [i * npix, (i + 1) * npix])
+        return pairs.select(slice(start, end))
 
-    def broadcast_arrays(
-        self, i: int, icld: tuple[int, int]
-    ) -> list[float, float, float, float]:
+    def match_vgac_cloudsat_batched(self):
         """
-        broadcast lat/lon arrays to 2d to enable vectorized calculation
-        of distances
+        match all VGAC scans of the granule at once, with the same result
+        as the per scan loop: the match pairs of each scan are limited to
+        the part of the Cloudsat track crossing it, scans where that part is
+        all cloud free are skipped, and the profile nearest in latitude and
+        longitude is assigned
         """
-
-        def _broadcast(arr, shape1, shape2):
-            return np.broadcast_to(arr, (shape1, shape2))
-
-        icld1, icld2 = icld[0], icld[1]
-        shape1 = self.cloudsat.longitude[icld1:icld2].shape[0]
-        shape2 = self.vgac.longitude[i, :].shape[0]
-
-        lon_c = _broadcast(
-            self.cloudsat.longitude[icld1:icld2].reshape(-1, 1), shape1, shape2
+        pairs = self.find_match_pairs()
+        row = pairs.pixel // self.vgac.latitude.shape[1]
+        start, end = self.scan_track_bounds()
+        pairs = pairs.select((pairs.profile >= start[row]) & (pairs.profile < end[row]))
+        row, col = np.unravel_index(pairs.pixel, self.vgac.latitude.shape)
+        lat_diff = self.cloudsat.latitude[pairs.profile] - self.vgac.latitude[row, col]
+        lon_diff = (
+            self.cloudsat.longitude[pairs.profile] - self.vgac.longitude[row, col]
         )
-        lat_c = _broadcast(
-            self.cloudsat.latitude[icld1:icld2].reshape(-1, 1), shape1, shape2
+        pairs = nearest_per_pixel(pairs, np.hypot(lat_diff, lon_diff))
+        row, col = np.unravel_index(pairs.pixel, self.vgac.latitude.shape)
+        self.collocated_data.set(
+            row,
+            col,
+            {
+                key: getattr(self.cloudsat, key)[pairs.profile]
+                for key in CNN_MATCHED_PARAMETERS
+            },
         )
-        lon_v = _broadcast(self.vgac.longitude[i, :].reshape(1, -1), shape1, shape2)
-        lat_v = _broadcast(self.vgac.latitude[i, :].reshape(1, -1), shape1, shape2)
 
-        return lon_c, lat_c, lon_v, lat_v
+    def scan_track_bounds(self) -> tuple[np.ndarray, np.ndarray]:
+        """[start, end) of the Cloudsat track segment used for each VGAC scan,
+        empty for scans without segment or with an all cloud free segment"""
+        nscan = len(self.vgac.latitude)
+        start, end = np.zeros(nscan, dtype=int), np.zeros(nscan, dtype=int)
+        # number of cloudy profiles before each profile
+        cloudy = np.concatenate(([0], np.cumsum(~(self.cloudsat.cloud_base < 0))))
+        for i in range(nscan):
+            icld = self.get_index_closest_cloudsat_track(i)
+            if icld is not None and cloudy[icld[1]] > cloudy[icld[0]]:
+                start[i], end[i] = icld
+        return start, end
+
+    def aggregate_vgac_cloudsat(self):
+        """
+        mean, std, min, max and count of all Cloudsat profiles within
+        COLLOCATION_THRESHOLD and TIME_DIFF_ALLOWED of each VGAC pixel, added
+        to collocated data as e.g. cloud_base_mean, cloud_base_count.
+        The count of a parameter is its number of valid values, pair_count
+        is the number of all matched Cloudsat profiles, clear sky included
+        """
+        pairs = self.find_match_pairs()
+        pixels, pair_count, statistics = aggregate_pairs(
+            pairs.pixel,
+            {
+                key: getattr(self.cloudsat, key)[pairs.profile]
+                for key in CNN_MATCHED_PARAMETERS
+            },
+        )
+        row, col = np.unravel_index(pixels, self.vgac.latitude.shape)
+        self.collocated_data.add_parameter("pair_count", 0, np.result_type(0))
+        self.collocated_data.set(row, col, {"pair_count": pair_count})
+        for key, key_statistics in statistics.items():
+            for statistic, values in key_statistics.items():
+                name = f"{key}_{statistic}"
+                fill = 0 if statistic == "count" else -999.9
+                self.collocated_data.add_parameter(name, fill, np.result_type(fill))
+                self.collocated_data.set(row, col, {name: values})
+
+    def process_matching_iteration_nearest(self, i: int, icld: tuple[int, int]):
+        """the matching process is run for each VGAC scan,
+        Cloudsat pixels within radius given by COLLOCATION_THRESHOLD
+        and TIME_DIFF_ALLOWED are taken from the match pairs of the granule,
+        and the nearest one gives the cloud base height at eligible pixels
+        of VGAC
+        """
+        pairs = self.scan_match_pairs(i)
+        pairs = pairs.select((pairs.profile >= icld[0]) & (pairs.profile < icld[1]))
+        if len(pairs) > 0:
+            npix = self.vgac.latitude.shape[1]
+            self._collocate_data(i, icld, pairs.profile - icld[0], pairs.pixel % npix)
 
     def _collocate_data(self, i, icld, ix, iy):
         """
         update height/cf/layers and count number of cloudsat obs
-        used for each VGAC pixel"""
-
-        def _interpolate_nearest(x, y, z, x_new, y_new):
-            points = np.vstack([x, y]).T
-            xi = np.vstack((x_new, y_new)).T
-            return griddata(points, z, xi, method="nearest")
-
-        for key in CNN_MATCHED_PARAMETERS:
-            c_data = getattr(self.cloudsat, key)
-            v_data = self.collocated_data[key]
-            v_data[i, :][iy] = _interpolate_nearest(
-                self.cloudsat.latitude[icld[0] : icld[1]][ix],
-                self.cloudsat.longitude[icld[0] : icld[1]][ix],
-                c_data[icld[0] : icld[1]][ix],
-                self.vgac.latitude[i, :][iy],
-                self.vgac.longitude[i, :][iy],
-            )
-        self.collocated_data[key] = v_data
-
-    def get_tmask(self, itime: int):
-        """get part of cloudsat track within the time window"""
-        return (
-            self.cloudsat.time
-            >= self.vgac.time[itime, 0] + timedelta(minutes=TIME_WINDOW[0])
-        ) & (
-            self.cloudsat.time
-            <= self.vgac.time[itime, 0] + timedelta(minutes=TIME_WINDOW[1])
+        used for each VGAC pixel, the nearest cloudsat profile of each
+        VGAC pixel is looked up once and used to gather all parameters"""
+        profiles = icld[0] + ix
+        points = np.column_stack(
+            (self.cloudsat.latitude[profiles], self.cloudsat.longitude[profiles])
+        )
+        xi = np.column_stack((self.vgac.latitude[i, iy], self.vgac.longitude[i, iy]))
+        _, nearest = cKDTree(points).query(xi)
+        nearest_profiles = profiles[nearest]
+
+        self.collocated_data.set(
+            np.full(len(iy), i),
+            iy,
+            {
+                key: getattr(self.cloudsat, key)[nearest_profiles]
+                for key in CNN_MATCHED_PARAMETERS
+            },
         )
 
+    def get_time_windows(self) -> tuple[np.ndarray, np.ndarray]:
+        """[start, end) indices of the part of cloudsat track within TIME_WINDOW
+        of each VGAC scan, both scan and cloudsat times are sorted so this is
+        a single merge of the two time series"""
+        window = np.array(TIME_WINDOW) * np.timedelta64(1, "m")
+        start = np.searchsorted(
+            self.cloudsat_time64, self.scan_time64 + window[0], side="left"
+        )
+        end = np.searchsorted(
+            self.cloudsat_time64, self.scan_time64 + window[1], side="right"
+        )
+        return start, end
+
     def get_index_closest_cloudsat_track(
         self, itime: int
     ) -> Union[tuple[int, int], None]:
         """
         select part of Cloudsat track crossing the selected VGAC pixel
         """
-        # select part of cloudsat swath within TIME WINDOW
-        tmask = self.get_tmask(itime)
-        if len(tmask) > 0:
-            try:
-                index = int(self.vgac.latitude.shape[1] / 2)  # center of swath
-                distance = haversine_distance(
-                    self.vgac.latitude[itime, index],
-                    self.vgac.longitude[itime, index],
-                    self.cloudsat.latitude[tmask],
-                    self.cloudsat.longitude[tmask],
-                )
-                if len(distance) > 0:
-                    argmin = np.argmin(distance)
-                    index = np.arange(0, len(self.cloudsat.time), 1)[tmask][argmin]
-
-                    cld_mask = np.argwhere(
-                        (self.cloudsat.latitude > self.cloudsat.latitude[index] - 1.5)
-                        & (self.cloudsat.latitude < self.cloudsat.latitude[index] + 1.5)
-                        & (
-                            self.cloudsat.longitude
-                            > self.cloudsat.longitude[index] - 1.5
-                        )
-                        & (
-                            self.cloudsat.longitude
-                            < self.cloudsat.longitude[index] + 1.5
-                        )
-                    )
-                return (cld_mask[0][0], cld_mask[-1][0])
-            except Exception as e:
-                print(e)
-                return None
-        return None
+        if self._track_segments is None:
+            self._track_segments = self.sweep_track_segments()
+        return self._track_segments[itime]
+
+    def sweep_track_segments(self) -> list[Union[tuple[int, int], None]]:
+        """
+        part of Cloudsat track crossing each VGAC scan, found by walking along
+        the scans and the Cloudsat track together. The track point closest to
+        the swath centre and the +- TRACK_SEGMENT_HALF_WIDTH degree lat/lon box
+        around it only move forward from one scan to the next, so the total
+        cost is linear in the number of scans and profiles.
+        The result is the same as the nearest profile within TIME_WINDOW and
+        the first and last profile in the box around it, for a track that
+        crosses the box once. Distances are computed in float64 so that
+        nearly equidistant profiles are ordered as by haversine_distance
+        """
+        center = int(self.vgac.latitude.shape[1] / 2)  # center of swath
+        cloudsat_xyz = lonlat2xyz(self.cloudsat.longitude, self.cloudsat.latitude)
+        center_xyz = lonlat2xyz(
+            self.vgac.longitude[:, center], self.vgac.latitude[:, center]
+        )
+        starts, ends = self.get_time_windows()
+
+        segments = []
+        closest, first, last = None, 0, 0
+        for itime, (start, end) in enumerate(zip(starts, ends)):
+            xyz = center_xyz[itime]
+            if end <= start or np.any(np.isnan(xyz)):
+                segments.append(None)
+                continue
+            if closest is None or not start <= closest < end:
+                distance = chord_squared(cloudsat_xyz[start:end], xyz, dtype=float)
+                if np.all(np.isnan(distance)):
+                    segments.append(None)
+                    continue
+                closest = start + int(np.nanargmin(distance))
+            else:
+                closest = _descend_to_closest(cloudsat_xyz, xyz, closest, start, end)
+            first, last = self._track_segment(closest, first, last)
+            segments.append((first, last))
+        return segments
+
+    def _track_segment(self, closest: int, first: int, last: int) -> tuple[int, int]:
+        """first and last profile of the contiguous part of the track within
+        TRACK_SEGMENT_HALF_WIDTH degrees of profile closest, moved on from
+        the segment (first, last) of the previous scan"""
+        latitude, longitude = self.cloudsat.latitude, self.cloudsat.longitude
+
+        def _inside(k: int) -> bool:
+            return (
+                abs(latitude[k] - latitude[closest]) < TRACK_SEGMENT_HALF_WIDTH
+                and abs(longitude[k] - longitude[closest]) < TRACK_SEGMENT_HALF_WIDTH
+            )
+
+        first = min(first, closest)
+        while first < closest and not _inside(first):
+            first += 1
+        while first > 0 and _inside(first - 1):
+            first -= 1
+        last = max(last, closest)
+        while last > closest and not _inside(last):
+            last -= 1
+        while last + 1 < len(latitude) and _inside(last + 1):
+            last += 1
+        return first, last
 
     def _bounding_box(self, i: int, j: int):
         """bounding box for CNN input image"""
-        npix = len(self.vgac.time)
-        nscan = self.vgac.time.shape[0]
+        npix, nscan = self.vgac.latitude.shape
 
         return BoundingBox(
             max(0, i - int(YIMAGE_SIZE / 2)),
@@ -230,48 +419,134 @@ class DataMatcher:
         )
 
     def _interpolate_nwp_data(
-        self, parameter: str, projection: tuple[np.ndarray, np.ndarray]
-    ) -> np.ndarray:
-        try:
-            return self.era5.get_data(parameter, projection)
-        except Exception:
-            return np.ones([projection[0].shape]) * -999.9
-
-    def _make_cnn_data_matched_parameters(
-        self, lists_collocated_data: dict, box: BoundingBox
-    ):
-        for parameter, values in lists_collocated_data.items():
-            data = self.collocated_data[parameter]
-            values.append(data[box.i1 : box.i2, box.j1 : box.j2])
-
-    def _make_cnn_data_vgac_parameters(self, lists_vgac_data: dict, box: BoundingBox):
-        for parameter, values in lists_vgac_data.items():
-            data = getattr(self.vgac, parameter)
-            values.append(data[box.i1 : box.i2, box.j1 : box.j2])
+        self, parameters: list[str], projection: tuple[np.ndarray, np.ndarray]
+    ) -> dict[str, np.ndarray]:
+        """regrid all NWP parameters to one scene, the projection is only set
+        once for all parameters"""
+        return self.era5.get_fields(parameters, projection, fill_value=-999.9)
+
+    def _nwp_granule_region(
+        self, boxes: list[BoundingBox]
+    ) -> Union[BoundingBox, None]:
+        """part of the swath covering all scenes within rows I1:I2 of the
+        granule"""
+        offset = self.vgac.scanline_offset
+        inside = [
+            box for box in boxes if box.i1 + offset >= I1 and box.i2 + offset <= I2
+        ]
+        if len(inside) == 0:
+            return None
+        return BoundingBox(
+            min(box.i1 for box in inside),
+            max(box.i2 for box in inside),
+            min(box.j1 for box in inside),
+            max(box.j2 for box in inside),
+        )
 
-    def _make_cnn_data_vgac_parameters_pixel(
-        self, lists_vgac_data: dict, box: BoundingBox
-    ):
-        for parameter, values in lists_vgac_data.items():
-            data = getattr(self.vgac, parameter)
-            values.append(data[box.i1 : box.i2, box.j1 : box.j2])
+    def _regrid_nwp_granule(
+        self, parameters: list[str], region: BoundingBox
+    ) -> dict[str, np.ndarray]:
+        """regrid all NWP parameters once to the collocated part of the swath"""
+        projection = (
+            self.vgac.longitude[region.i1 : region.i2, region.j1 : region.j2],
+            self.vgac.latitude[region.i1 : region.i2, region.j1 : region.j2],
+        )
+        return self._interpolate_nwp_data(parameters, projection)
 
-    def _make_cnn_data_nwp_parameters(
-        self, lists_vgac_data: dict, lists_nwp_data: dict, inum: int
-    ):
-        for parameter, values in lists_nwp_data.items():
-            remap_lats = lists_vgac_data["latitude"][inum]
-            remap_lons = lists_vgac_data["longitude"][inum]
-            projection = (
-                remap_lons,
-                remap_lats,
-            )  # projection to regrid ERA5 data
-            values.append(self._interpolate_nwp_data(parameter, projection))
-
-    def create_cnn_dataset_with_nwp(self, to_file=True) -> xr.Dataset:
+    def _scene_nwp_parameters(
+        self,
+        box: BoundingBox,
+        granule_fields: Union[dict[str, np.ndarray], None],
+        region: Union[BoundingBox, None],
+    ) -> dict[str, np.ndarray]:
+        """NWP fields of one scene, cut as views from the regridded granule
+        fields if the scene lies within them, otherwise regridded here"""
+        if region is not None and region.i1 <= box.i1 and box.i2 <= region.i2:
+            i1, i2 = box.i1 - region.i1, box.i2 - region.i1
+            j1, j2 = box.j1 - region.j1, box.j2 - region.j1
+            return {
+                parameter: values[..., i1:i2, j1:j2]
+                for parameter, values in granule_fields.items()
+            }
+        projection = (
+            self.vgac.longitude[box.i1 : box.i2, box.j1 : box.j2],
+            self.vgac.latitude[box.i1 : box.i2, box.j1 : box.j2],
+        )  # projection to regrid ERA5 data
+        return self._interpolate_nwp_data(CNN_NWP_PARAMETERS, projection)
+
+    def make_scene(
+        self,
+        box: BoundingBox,
+        vgac_parameters: list[str],
+        granule_fields: Union[dict[str, np.ndarray], None] = None,
+        region: Union[BoundingBox, None] = None,
+    ) -> dict[str, np.ndarray]:
+        """all VGAC, matched and NWP parameters of one CNN scene, lazily
+        loaded VGAC channels are only read for the scene"""
+        crop = (slice(box.i1, box.i2), slice(box.j1, box.j2))
+        scene = {
+            parameter: np.asarray(self._vgac_parameter(parameter)[crop])
+            for parameter in vgac_parameters
+        }
+        for parameter in self.collocated_data:
+            scene[parameter] = self.collocated_data.densify(parameter, crop)
+        nwp = self._scene_nwp_parameters(box, granule_fields, region)
+        scene["base_pressure"] = self.cloud_base_pressure(
+            nwp["z_vertical"], nwp["p_vertical"], scene["cloud_base"]
+        )
+        for parameter, values in nwp.items():
+            if parameter not in ["z_vertical", "p_vertical", "t_vertical"]:
+                scene[parameter] = values
+        if "time" in scene:  # time cannot be stored as datetime in netcdf file
+            scene["time"] = (
+                datetime_to_datetime64(scene["time"])
+                - np.datetime64("1970-01-01T00:00:00")
+            ) / np.timedelta64(1, "s")
+        return scene
+
+    def _vgac_parameter(self, parameter: str) -> np.ndarray:
+        """VGAC parameter on the pixel grid, the scanline time is broadcast"""
+        if parameter == "time":
+            return self.vgac.pixel_time
+        return getattr(self.vgac, parameter)
+
+    def scene_boxes(self) -> list[BoundingBox]:
+        """bounding boxes of all full size scenes along the Cloudsat track"""
+        row, col, cloud_base = self.collocated_data.sparse("cloud_base")
+        # every YIMAGE_SIZE:th row of the granule, the pixels are sorted so the
+        # first one of each row is in the leftmost column with a cloud base
+        granule_row = row + self.vgac.scanline_offset
+        candidates = (cloud_base > 0) & (granule_row % YIMAGE_SIZE == 0)
+        rows, first = np.unique(row[candidates], return_index=True)
+        boxes = []
+        for ipix, iscan in zip(rows, col[candidates][first]):
+            box = self._bounding_box(int(ipix), int(iscan))
+            if (box.i2 - box.i1, box.j2 - box.j1) == (
+                YIMAGE_SIZE,
+                XIMAGE_SIZE,
+            ):
+                boxes.append(box)
+        return boxes
+
+    def create_cnn_dataset_with_nwp(
+        self,
+        to_file=True,
+        nwp_per_granule: bool = False,
+        encoding: Union[EncodingProfile, None] = None,
+        backend: str = "netcdf",
+    ) -> Union[xr.Dataset, None]:
         """
-        crop VGAC images to required size for CNN, add required NWP data,
-        and collect data into a xarray dataset
+        crop VGAC images to required size for CNN and add required NWP data.
+        With to_file the scenes are written one by one to out_filename, or
+        to a Zarr store next to it with backend "zarr", otherwise they are
+        collected into a xarray dataset.
+        The encoding profile (default EncodingProfile()) sets compression,
+        chunking and data types on disk, also for the returned dataset, where
+        values of packed parameters that do not fit in int16 are NaN.
+        With nwp_per_granule the NWP data is regridded only once, to the part
+        of the swath (rows I1:I2) covering all scenes, and the scenes are cut
+        from it. This needs memory for all NWP fields of that part of the
+        swath, scenes outside I1:I2 are regridded one by one.
         """
         if isinstance(self.vgac, VGACData):
             vgac_parameter_names_list = CNN_VGAC_PARAMETERS
@@ -280,98 +555,86 @@ class DataMatcher:
         else:
             raise ValueError(f"{self.VGAC} is not supported")
         print(vgac_parameter_names_list)
-        lists_vgac_data = {name: [] for name in vgac_parameter_names_list}
-        lists_collocated_data = {name: [] for name in CNN_MATCHED_PARAMETERS}
-        lists_nwp_data = {name: [] for name in CNN_NWP_PARAMETERS}
-
-        inum = 0
-        for ipix in range(0, len(self.vgac.time), YIMAGE_SIZE):
-            iscan = np.where(self.collocated_data["cloud_base"][ipix, :] > 0)[0]
-            if len(iscan) > 0:
-                iscan = iscan[0]
-
-                box = self._bounding_box(ipix, iscan)
-                if (box.i2 - box.i1, box.j2 - box.j1) == (
-                    YIMAGE_SIZE,
-                    XIMAGE_SIZE,
-                ):
-                    self._make_cnn_data_vgac_parameters(lists_vgac_data, box)
-                    self._make_cnn_data_matched_parameters(lists_collocated_data, box)
-                    self._make_cnn_data_nwp_parameters(
-                        lists_vgac_data, lists_nwp_data, inum
-                    )
-                    inum += 1
-
-        if len(list(lists_nwp_data.values())[0]) > 0:
-            self.add_cloud_base_pressure(lists_nwp_data, lists_collocated_data)
-            ds = self._make_dataset(
-                lists_vgac_data, lists_collocated_data, lists_nwp_data
-            )
-            if to_file is True:
-                ds.to_netcdf(self.out_filename)
-        else:
-            raise ValueError("No matches found")
+        if backend not in SCENE_WRITERS:
+            raise ValueError(f"{backend} is not a supported backend")
+        if encoding is None:
+            encoding = EncodingProfile()
 
-    def add_cloud_base_pressure(self, lists_nwp_data, lists_collocated_data):
-        # def _interpolate_column(z_vertical, p_vertical, base_heights):
-        #     return interp1d(
-        #         z_vertical,
-        #         p_vertical,
-        #         axis=0,
-        #         kind="linear",
-        #         bounds_error=False,
-        #         fill_value="extrapolate",
-        #     )(base_heights)
-
-        base_height = lists_collocated_data["cloud_base"]
-        z_vertical = lists_nwp_data["z_vertical"]
-        p_vertical = lists_nwp_data["p_vertical"]
-        lists_collocated_data["base_pressure"] = []
-        for case in range(len(base_height)):
-            base_pres = np.zeros_like(base_height[case])
-            for i in range(XIMAGE_SIZE):
-                for j in range(YIMAGE_SIZE):
-                    base_pres[i, j] = interp1d(
-                        z_vertical[case][:, i, j],
-                        p_vertical[case][:, i, j],
-                        bounds_error=False,
-                    )(base_height[case][i, j])
-            base_pres[base_height[case] < 0] = -999.9
-            lists_collocated_data["base_pressure"].append(base_pres)
+        boxes = self.scene_boxes()
+        if len(boxes) == 0:
+            raise ValueError("No matches found")
+        region = self._nwp_granule_region(boxes) if nwp_per_granule else None
+        granule_fields = None
+        if region is not None:
+            granule_fields = self._regrid_nwp_granule(CNN_NWP_PARAMETERS, region)
+
+        scenes = (
+            self.make_scene(box, vgac_parameter_names_list, granule_fields, region)
+            for box in boxes
+        )
+        if to_file is True:
+            filename = self.out_filename
+            if backend == "zarr":
+                filename = f"{os.path.splitext(filename)[0]}.zarr"
+            with SCENE_WRITERS[backend](filename, encoding) as writer:
+                for scene in scenes:
+                    writer.write_scene(scene)
+            return None
+        return self._make_dataset(list(scenes), encoding)
+
+    @staticmethod
+    def cloud_base_pressure(
+        z_vertical: np.ndarray, p_vertical: np.ndarray, base_height: np.ndarray
+    ) -> np.ndarray:
+        """interpolate the NWP pressure to the cloud base height of each pixel"""
+        base_pres = interpolate_columns(z_vertical, p_vertical, base_height).astype(
+            base_height.dtype
+        )
+        base_pres[base_height < 0] = -999.9
+        return base_pres
 
     def _make_dataset(
-        self,
-        lists_vgac_data: dict,
-        lists_collocated_data: dict,
-        lists_nwp_data: dict,
+        self, scenes: list[dict[str, np.ndarray]], encoding: EncodingProfile
     ) -> xr.Dataset:
         ds = xr.Dataset()
 
-        nscene = np.arange(len(lists_vgac_data["latitude"]))
+        nscene = np.arange(len(scenes))
         npix = np.arange(YIMAGE_SIZE)
         nscan = np.arange(XIMAGE_SIZE)
-        parameter_types = {
-            "VGAC": lists_vgac_data,
-            "MATCHED": lists_collocated_data,
-            "NWP": lists_nwp_data,
-        }
-
-        for _, data_list in parameter_types.items():
-            for parameter in data_list.keys():
-                if parameter in ["z_vertical", "p_vertical", "t_vertical"]:
-                    continue
-                if (
-                    parameter == "time"
-                ):  # time cannot be stred as datetime in netcdf file
-                    values = np.vectorize(lambda dt: dt.timestamp())(
-                        np.stack(data_list[parameter])
-                    )
-                else:
-                    values = np.stack(data_list[parameter])
-                ds[parameter] = xr.DataArray(
-                    values,
-                    dims=("nscene", "npix", "nscan"),
-                    coords={"npix": npix, "nscan": nscan, "nscene": nscene},
-                )
+        for parameter in scenes[0]:
+            values = np.stack([scene[parameter] for scene in scenes])
+            if parameter in encoding.packed:  # fill values would wrap in int16
+                values = mask_unpackable(values, *encoding.packed[parameter])
+            ds[parameter] = xr.DataArray(
+                values,
+                dims=("nscene", "npix", "nscan"),
+                coords={"npix": npix, "nscan": nscan, "nscene": nscene},
+            )
+            ds[parameter].encoding = encoding.variable_encoding(
+                parameter, ds[parameter].dtype
+            )
 
         return ds
+
+
+def _descend_to_closest(
+    track_xyz: np.ndarray, xyz: np.ndarray, closest: int, start: int, end: int
+) -> int:
+    """move from profile closest to the nearest profile of xyz within
+    [start, end), stepping to a neighbour while it is closer"""
+
+    def _distance(k: int) -> float:
+        return float(chord_squared(track_xyz[k], xyz, dtype=float))
+
+    while closest + 1 < end and _distance(closest + 1) < _distance(closest):
+        closest += 1
+    while closest - 1 >= start and _distance(closest - 1) < _distance(closest):
+        closest -= 1
+    return closest
+
+
+def time_diff_minutes(times1: np.ndarray, times2: np.ndarray) -> np.ndarray:
+    """absolute time difference in minutes between two arrays of times"""
+    return np.abs((times1 - times2).astype("timedelta64[us]")) / np.timedelta64(
+        1, "m"
+    )
@@ -0,0 +1,166 @@
+import os
+import shutil
+from typing import Iterator, Optional, Union
+import numpy as np
+import netCDF4
+import xarray as xr
+from .config import XIMAGE_SIZE, YIMAGE_SIZE
+from .encoding import EncodingProfile, mask_unpackable, pack_int16
+
+
+class NetCDFSceneWriter:
+    """
+    write CNN scenes one at a time to a netCDF file with an unlimited nscene
+    dimension, so only one scene has to be kept in memory. The file is
+    written under a temporary name and only moved in place when closed
+    without errors. Parameters are stored as given by the encoding profile
+    """
+
+    def __init__(self, filename: str, encoding: Union[EncodingProfile, None] = None):
+        self.filename = filename
+        self.encoding = EncodingProfile() if encoding is None else encoding
+        self.nscene = 0
+        self._tmp_filename = f"{filename}.tmp"
+        self._nc: Optional[netCDF4.Dataset] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(keep=exc_type is None)
+
+    def _create(self, scene: dict[str, np.ndarray]) -> netCDF4.Dataset:
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+        nc = netCDF4.Dataset(self._tmp_filename, "w")
+        nc.createDimension("nscene", None)
+        nc.createDimension("npix", YIMAGE_SIZE)
+        nc.createDimension("nscan", XIMAGE_SIZE)
+        nc.createVariable("nscene", np.int64, ("nscene",))
+        for dim, size in (("npix", YIMAGE_SIZE), ("nscan", XIMAGE_SIZE)):
+            nc.createVariable(dim, np.int64, (dim,))[:] = np.arange(size)
+        for parameter, values in scene.items():
+            encoding = self.encoding.variable_encoding(parameter, values.dtype)
+            dtype = np.dtype(encoding.get("dtype", values.dtype))
+            fill_value = np.nan if dtype.kind == "f" else False
+            variable = nc.createVariable(
+                parameter,
+                dtype,
+                ("nscene", "npix", "nscan"),
+                compression=encoding.get("compression"),
+                complevel=encoding.get("complevel", 4),
+                shuffle=encoding.get("shuffle", False),
+                chunksizes=encoding["chunksizes"],
+                fill_value=encoding.get("_FillValue", fill_value),
+            )
+            variable.set_auto_maskandscale(False)
+            for attribute in ("scale_factor", "add_offset"):
+                if attribute in encoding:
+                    variable.setncattr(attribute, encoding[attribute])
+        return nc
+
+    def write_scene(self, scene: dict[str, np.ndarray]):
+        """append one scene, all scenes must have the same parameters"""
+        if self._nc is None:
+            self._nc = self._create(scene)
+        for parameter, values in scene.items():
+            if parameter in self.encoding.packed:
+                values = pack_int16(values, *self.encoding.packed[parameter])
+            self._nc[parameter][self.nscene] = values
+        self._nc["nscene"][self.nscene] = self.nscene
+        self.nscene += 1
+
+    def close(self, keep: bool = True):
+        """close the file, it is removed if keep is False"""
+        if self._nc is None:
+            return
+        self._nc.close()
+        self._nc = None
+        if keep:
+            os.replace(self._tmp_filename, self.filename)
+        else:
+            os.remove(self._tmp_filename)
+
+
+class ZarrSceneWriter:
+    """
+    write CNN scenes one at a time to a Zarr store, with one chunk per scene
+    and parameter and consolidated metadata, so single scenes can be read
+    without splitting the files. Packing and data types follow the encoding
+    profile, compression is the Zarr default
+    """
+
+    def __init__(self, filename: str, encoding: Union[EncodingProfile, None] = None):
+        self.filename = filename
+        self.encoding = EncodingProfile() if encoding is None else encoding
+        self.nscene = 0
+        self._tmp_filename = f"{filename}.tmp"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(keep=exc_type is None)
+
+    def _variable(self, parameter: str, values: np.ndarray) -> xr.Variable:
+        encoding = self.encoding.variable_encoding(parameter, values.dtype)
+        if parameter in self.encoding.packed:
+            values = mask_unpackable(values, *self.encoding.packed[parameter])
+        variable = xr.Variable(("nscene", "npix", "nscan"), values[np.newaxis])
+        if self.nscene == 0:  # appended scenes reuse the encoding of the store
+            variable.encoding = {
+                key: encoding[key]
+                for key in ("dtype", "scale_factor", "add_offset", "_FillValue")
+                if key in encoding
+            }
+            variable.encoding["chunks"] = encoding["chunksizes"]
+        return variable
+
+    def write_scene(self, scene: dict[str, np.ndarray]):
+        """append one scene, all scenes must have the same parameters"""
+        ds = xr.Dataset(
+            {
+                parameter: self._variable(parameter, values)
+                for parameter, values in scene.items()
+            },
+            coords={
+                "nscene": [self.nscene],
+                "npix": np.arange(YIMAGE_SIZE),
+                "nscan": np.arange(XIMAGE_SIZE),
+            },
+        )
+        if self.nscene == 0:
+            ds.to_zarr(self._tmp_filename, mode="w", consolidated=True)
+        else:
+            ds.to_zarr(self._tmp_filename, append_dim="nscene", consolidated=True)
+        self.nscene += 1
+
+    def close(self, keep: bool = True):
+        """move the store in place, it is removed if keep is False"""
+        if self.nscene == 0:
+            return
+        if keep:
+            if os.path.isdir(self.filename):
+                shutil.rmtree(self.filename)
+            os.replace(self._tmp_filename, self.filename)
+        else:
+            shutil.rmtree(self._tmp_filename)
+
+
+SCENE_WRITERS = {"netcdf": NetCDFSceneWriter, "zarr": ZarrSceneWriter}
+
+
+def open_cnn_data(filename: str) -> xr.Dataset:
+    """open a cnn_data netCDF file or Zarr store, lazily"""
+    if filename.rstrip("/").endswith(".zarr"):
+        return xr.open_zarr(filename, consolidated=True)
+    return xr.open_dataset(filename)
+
+
+def iter_scenes(filename: str) -> Iterator[xr.Dataset]:
+    """all scenes of a cnn_data file, a file split per scene is one scene"""
+    with open_cnn_data(filename) as ds:
+        if "nscene" not in ds.dims:
+            yield ds
+            return
+        for iscene in range(ds.sizes["nscene"]):
+            yield ds.isel(nscene=iscene).load()
@@ -245,3 +245,30 @@ mock_interp_cloud_fraction = np.array(
         [-999.9, 0.8, -999.9, -999.9, -999.9, -999.9, -999.9, -999.9, -999.9, -999.9],
     ]
 )
+
+
+def mock_crossing_orbit(
+    nscan: int = 400,
+    nprofile: int = 3000,
+    time_shift_minutes: float = 0.0,
+    lon_shift: float = 0.0,
+) -> tuple[dict, dict]:
+    """latitude, longitude and time of a Cloudsat track and a 300 pixel wide
+    VGAC swath it crosses, the track starts 100 s before the first scan.
+    The track can be shifted in time and to the east"""
+    start_time = np.datetime64("2018-05-30T01:00", "ns")
+    scan, pixel = np.arange(nscan)[:, np.newaxis], np.arange(300)
+    vgac = {
+        "latitude": -10 + 0.045 * scan + 0.001 * pixel,
+        "longitude": 15 + 0.05 * pixel + 0.002 * scan,
+        "time": start_time + (720 * np.arange(nscan)).astype("timedelta64[ms]"),
+    }
+    profile = np.arange(nprofile)
+    cloudsat = {
+        "latitude": -12 + 0.0085 * profile,
+        "longitude": 21.5 + lon_shift + 0.0004 * profile,
+        "time": start_time
+        + np.timedelta64(int(time_shift_minutes * 60), "s")
+        + (135 * profile - 100000).astype("timedelta64[ms]"),
+    }
+    return cloudsat, vgac
@@ -0,0 +1,55 @@
+import os
+import numpy as np
+from cbase.data_readers.cloudsat import CloudsatData
+from cbase.utils.cache import file_identity, load_npz_cache, save_npz_cache
+
+
+def test_npz_cache_round_trip(tmp_path):
+    """arrays read back unchanged, missing and broken files give None"""
+    filename = os.path.join(tmp_path, "cache", "pairs.npz")
+    arrays = {"row": np.arange(5, dtype=np.int32), "distance": np.linspace(0, 1, 5)}
+    assert load_npz_cache(filename) is None
+
+    save_npz_cache(filename, arrays)
+    cache = load_npz_cache(filename)
+    assert sorted(cache) == sorted(arrays)
+    for key, values in arrays.items():
+        assert np.array_equal(cache[key], values)
+        assert cache[key].dtype == values.dtype
+    assert os.listdir(os.path.dirname(filename)) == ["pairs.npz"]
+
+    with open(filename, "wb") as f:
+        f.write(b"not a npz file")
+    assert load_npz_cache(filename) is None
+
+
+def test_file_identity_changes_with_content(tmp_path):
+    """a replaced file with the same name has another identity"""
+    filename = os.path.join(tmp_path, "granule.hdf")
+    with open(filename, "wb") as f:
+        f.write(b"first")
+    identity = file_identity(filename)
+    assert identity[0] == "granule.hdf"
+    with open(filename, "wb") as f:
+        f.write(b"reprocessed")
+    assert file_identity(filename) != identity
+
+
+def test_cloudsat_track_cache_round_trip(tmp_path):
+    """the derived Cloudsat track is read back from the cache"""
+    n = 4
+    track = CloudsatData(
+        *[np.arange(n, dtype=float) + i for i in range(9)],
+        np.datetime64("2018-05-30T01:00", "ns") + np.arange(n) * np.timedelta64(1, "s"),
+        "cloudsat_file.hdf",
+        (("cloudsat_file.hdf", 10, 20),),
+    )
+    cache_file = os.path.join(tmp_path, "cloudsat.npz")
+    track.to_cache(cache_file)
+
+    cached = CloudsatData.from_cache(cache_file, track.name, track.source_files)
+    assert cached.name == track.name
+    assert cached.source_files == track.source_files
+    for name in ("longitude", "cloud_base_temp", "time"):
+        assert np.array_equal(getattr(cached, name), getattr(track, name))
+    assert CloudsatData.from_cache(os.path.join(tmp_path, "none.npz"), "x") is None
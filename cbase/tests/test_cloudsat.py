@@ -1,10 +1,8 @@
 import os
 from pathlib import Path
 from unittest.mock import patch
-import pytz
 import numpy as np
 import pytest
-from datetime import datetime
 from cbase.data_readers.cloudsat_products import (
     CloudsatData,
     BaseDate,
@@ -48,10 +46,7 @@ def mock_read_cloudsat_hdf4():
 
 def test_get_time():
     expected_result = np.array(
-        [
-            datetime(1993, 1, 1, 2, 0, 0, tzinfo=pytz.UTC),
-            datetime(1993, 1, 1, 3, 0, 0, tzinfo=pytz.UTC),
-        ]
+        ["1993-01-01T02:00:00", "1993-01-01T03:00:00"], dtype="datetime64[ns]"
     )
     print(get_time(sample_data))
     assert np.array_equal(get_time(sample_data), expected_result)
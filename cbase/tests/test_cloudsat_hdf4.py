@@ -0,0 +1,50 @@
+import numpy as np
+from pyhdf.SD import SD, SDC
+from pyhdf.HDF import HDF, HC
+from cbase.data_readers.cloudsat import (
+    get_profile_range,
+    get_time,
+    read_cloudsat_hdf4,
+)
+
+NAMES = ["CloudLayerBase", "Latitude", "Profile_time", "TAI_start"]
+
+
+def make_hdf4_file(filename: str, nprofile: int = 50):
+    """small Cloudsat like HDF4 file with a 2D SDS, per profile Vdata and
+    the single record TAI_start"""
+    sd = SD(filename, SDC.WRITE | SDC.CREATE)
+    sds = sd.create("CloudLayerBase", SDC.FLOAT32, (nprofile, 5))
+    sds[:] = np.arange(nprofile * 5, dtype=np.float32).reshape(nprofile, 5)
+    sds.endaccess()
+    sd.end()
+    h4file = HDF(filename, HC.WRITE)
+    vs = h4file.vstart()
+    for name, values, data_type in (
+        ("Latitude", np.linspace(-10, 10, nprofile), HC.FLOAT32),
+        ("Profile_time", 0.16 * np.arange(nprofile), HC.FLOAT32),
+        ("TAI_start", [801450000.0], HC.FLOAT64),
+    ):
+        vd = vs.create(name, ((name, data_type, 1),))
+        vd.write([[float(value)] for value in values])
+        vd.detach()
+    vs.end()
+    h4file.close()
+
+
+def test_profile_range_same_as_full_read(tmp_path):
+    """SDS and Vdata read for a profile range are the slice of a full read,
+    a range beyond the last profile is cut at it"""
+    filename = str(tmp_path / "cloudsat.hdf")
+    make_hdf4_file(filename)
+    full = read_cloudsat_hdf4(filename, NAMES)
+    times = get_time(full)
+
+    profiles = get_profile_range(filename, times[10], times[19])
+    assert profiles == (10, 20)
+    for start, end in (profiles, (45, 60)):
+        subset = read_cloudsat_hdf4(filename, NAMES, (start, end))
+        assert sorted(subset) == sorted(NAMES)
+        for name in ("CloudLayerBase", "Latitude", "Profile_time"):
+            assert np.array_equal(subset[name], full[name][start:end])
+        assert np.array_equal(subset["TAI_start"], full["TAI_start"])
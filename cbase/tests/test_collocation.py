@@ -0,0 +1,83 @@
+import numpy as np
+from cbase.matching.collocation import (
+    CollocatedData,
+    CollocationIndex,
+    MatchPairs,
+    aggregate_pairs,
+    nearest_per_pixel,
+)
+from cbase.utils.utils import haversine_distance
+from cbase.tests.mock_data import mock_lat, mock_lon
+
+cloudsat_lat = np.linspace(-37, -36.85, 10)
+cloudsat_lon = np.linspace(168.6, 169.0, 10)
+
+
+def test_query_radius_matches_brute_force():
+    """radius query gives the same pairs as the dense distance matrix"""
+    index = CollocationIndex(cloudsat_lat, cloudsat_lon)
+    pairs = index.query_radius(mock_lat, mock_lon, 4)
+
+    distances = haversine_distance(
+        mock_lat.reshape(-1, 1),
+        mock_lon.reshape(-1, 1),
+        cloudsat_lat.reshape(1, -1),
+        cloudsat_lon.reshape(1, -1),
+    )
+    pixel, profile = np.nonzero(distances <= 4)
+
+    assert sorted(zip(pairs.pixel, pairs.profile)) == sorted(zip(pixel, profile))
+    assert np.allclose(pairs.distance, distances[pairs.pixel, pairs.profile])
+
+
+def test_query_radius_no_matches():
+    """pixels far from the track give no pairs"""
+    index = CollocationIndex(cloudsat_lat, cloudsat_lon)
+    pairs = index.query_radius(mock_lat + 10, mock_lon, 4)
+    assert len(pairs) == 0
+
+
+def test_nearest_per_pixel():
+    """one pair per pixel, with the smallest distance"""
+    pairs = MatchPairs(
+        np.array([3, 1, 3, 1, 5]),
+        np.array([0, 1, 2, 3, 4]),
+        np.array([2.0, 1.5, 0.5, 3.0, 1.0]),
+    )
+    nearest = nearest_per_pixel(pairs)
+    assert np.array_equal(nearest.pixel, [1, 3, 5])
+    assert np.array_equal(nearest.profile, [1, 2, 4])
+
+
+def test_aggregate_pairs():
+    """statistics per pixel leave out fill values, the pair count does not"""
+    pixel = np.array([7, 2, 7, 7, 2, 4])
+    values = {"cloud_base": np.array([1.0, 2.0, 3.0, -999.9, 4.0, -999.9])}
+    pixels, pair_count, statistics = aggregate_pairs(pixel, values)
+
+    assert np.array_equal(pixels, [2, 4, 7])
+    assert np.array_equal(pair_count, [2, 1, 3])
+    cloud_base = statistics["cloud_base"]
+    assert np.array_equal(cloud_base["count"], [2, 0, 2])
+    assert np.allclose(cloud_base["mean"], [3.0, -999.9, 2.0])
+    assert np.allclose(cloud_base["std"], [1.0, -999.9, 1.0])
+    assert np.allclose(cloud_base["min"], [2.0, -999.9, 1.0])
+    assert np.allclose(cloud_base["max"], [4.0, -999.9, 3.0])
+
+
+def test_collocated_data_densify():
+    """sparse values give the same dense crops as a full granule array"""
+    data = CollocatedData((6, 8), ["cloud_base"])
+    data.set([1, 4, 4], [2, 0, 7], {"cloud_base": [100.0, 200.0, 300.0]})
+    data.set([4], [0], {"cloud_base": [250.0]})
+
+    expected = np.full((6, 8), -999.9)
+    expected[[1, 4, 4], [2, 0, 7]] = [100.0, 250.0, 300.0]
+    assert np.array_equal(data.densify("cloud_base"), expected)
+    crop = (slice(1, 5), slice(0, 4))
+    assert np.array_equal(data.densify("cloud_base", crop), expected[crop])
+
+    row, col, values = data.sparse("cloud_base")
+    assert np.array_equal(row, [1, 4, 4])
+    assert np.array_equal(col, [2, 0, 7])
+    assert np.array_equal(values, [100.0, 250.0, 300.0])
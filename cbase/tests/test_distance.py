@@ -0,0 +1,23 @@
+import numpy as np
+from cbase.utils.distance import lonlat2xyz, chord2km, chord_squared
+from cbase.utils.utils import haversine_distance
+from cbase.tests.mock_data import mock_lat, mock_lon
+
+
+def test_chord_squared():
+    """chord based distances agree with haversine to within a few metres"""
+    xyz = lonlat2xyz(mock_lon, mock_lat, dtype=np.float32)
+    distance = chord2km(np.sqrt(chord_squared(xyz, xyz[0, 0])))
+    expected = haversine_distance(mock_lat[0, 0], mock_lon[0, 0], mock_lat, mock_lon)
+    assert np.allclose(distance, expected, atol=5e-3)
+
+
+def test_chord_squared_with_out_buffer():
+    """squared chords are written into the given buffer, in float64 they
+    order the pixels as haversine does"""
+    xyz = lonlat2xyz(mock_lon, mock_lat)
+    out = np.empty(mock_lat.shape)
+    chord_squared(xyz, xyz[2, 5], out=out, dtype=np.float64)
+    expected = haversine_distance(mock_lat[2, 5], mock_lon[2, 5], mock_lat, mock_lon)
+    assert out[2, 5] == 0
+    assert np.array_equal(np.argsort(out, axis=None), np.argsort(expected, axis=None))
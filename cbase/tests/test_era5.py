@@ -0,0 +1,44 @@
+from unittest.mock import MagicMock
+import numpy as np
+import pytest
+from cbase.data_readers.era5 import Era5
+
+
+def make_grib(shape: tuple[int, int]) -> MagicMock:
+    """mock GRIBFile with temperature and humidity on pressure levels, the
+    total column ice water vapour is outside the grid"""
+    grb = MagicMock()
+    grb.get_t_pressure.side_effect = lambda level: np.full(shape, 200 + level / 10)
+    grb.get_q_pressure.side_effect = lambda level: np.full(shape, level / 1e6)
+    grb.get_ciwv.side_effect = ValueError("Projection outside the grid")
+    return grb
+
+
+def test_get_fields_one_projection():
+    """all parameters are read with one projection, pressure levels are read
+    once per projection and unreadable parameters get the fill value"""
+    projection = (np.zeros((2, 3)), np.ones((2, 3)))
+    grb = make_grib((2, 3))
+    era5 = Era5(grb)
+
+    fields = era5.get_fields(
+        ["t500", "q500", "rh500", "t850", "ciwv"], projection, fill_value=-999.9
+    )
+    grb.set_projection.assert_called_once_with(projection)
+    assert grb.get_t_pressure.call_count == 2
+    assert grb.get_q_pressure.call_count == 1
+    assert np.all(fields["t500"] == 250.0)
+    assert fields["rh500"].shape == (2, 3)
+    assert np.all(fields["ciwv"] == -999.9)
+    assert fields["ciwv"].shape == (2, 3)
+
+    era5.read_parameter("rh850")  # t850 is cached, q850 is not
+    assert grb.get_t_pressure.call_count == 2
+    assert grb.get_q_pressure.call_count == 2
+
+    era5.get_fields(["t500"], projection)
+    assert grb.set_projection.call_count == 2
+    assert grb.get_t_pressure.call_count == 3
+
+    with pytest.raises(ValueError):
+        era5.get_fields(["ciwv"], projection)
@@ -0,0 +1,34 @@
+import numpy as np
+from cbase.matching.config import YIMAGE_SIZE
+from cbase.matching.footprint import collocation_scanlines, footprints_overlap
+from cbase.tests.mock_data import mock_crossing_orbit
+
+
+def test_collocation_scanlines():
+    """scanlines within the time of the Cloudsat pass, padded by half a scene"""
+    scan_time = np.datetime64("2018-05-30T01:00") + np.arange(2000) * np.timedelta64(
+        1, "s"
+    )
+    cloudsat_time = scan_time[1000] + np.arange(60) * np.timedelta64(1, "s")
+    cloudsat_time[0] = np.datetime64("NaT")
+
+    start, end = collocation_scanlines(cloudsat_time, scan_time)
+    assert start == 1001 - 300 - YIMAGE_SIZE // 2
+    assert end == 1059 + 300 + 1 + YIMAGE_SIZE // 2
+    assert collocation_scanlines(cloudsat_time, scan_time[:300]) is None
+    assert collocation_scanlines(cloudsat_time, scan_time[:800]) == (
+        701 - YIMAGE_SIZE // 2,
+        800,
+    )
+
+
+def test_footprints_overlap():
+    """overlap only when the track crosses the swath close enough in time"""
+    assert footprints_overlap(*mock_crossing_orbit())
+    # same track, passing 30 minutes later
+    assert not footprints_overlap(*mock_crossing_orbit(time_shift_minutes=30))
+    # same time, but 20 degrees east of the swath
+    assert not footprints_overlap(*mock_crossing_orbit(lon_shift=20))
+    cloudsat, vgac = mock_crossing_orbit()
+    cloudsat["time"][:] = np.datetime64("NaT")
+    assert not footprints_overlap(cloudsat, vgac)
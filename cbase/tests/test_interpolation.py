@@ -0,0 +1,86 @@
+import numpy as np
+from scipy.interpolate import interp1d
+from cbase.utils.interpolation import interpolate_columns
+from cbase.data_readers.cloudsat import get_level_range, sample_profiles
+
+
+def test_interpolate_columns_matches_interp1d():
+    """same result as one interp1d per column, also outside the columns"""
+    rng = np.random.default_rng(1)
+    z = np.sort(rng.uniform(0, 20000, (30, 4, 5)), axis=0)[::-1]
+    p = np.sort(rng.uniform(100, 1000, (30, 4, 5)), axis=0)
+    base = rng.uniform(-1000, 21000, (4, 5))
+    base[0, 0] = z[-1, 0, 0]
+
+    result = interpolate_columns(z, p, base)
+    for i in range(4):
+        for j in range(5):
+            expected = interp1d(z[:, i, j], p[:, i, j], bounds_error=False)(
+                base[i, j]
+            )
+            assert np.allclose(result[i, j], expected, equal_nan=True)
+
+
+def test_interpolate_columns_fill_values():
+    """missing targets and columns with missing levels give fill_value"""
+    z = np.tile(np.arange(5.0)[:, np.newaxis], (1, 3))
+    t = 2 * z
+    t[2, 1] = np.nan
+    base = np.array([1.5, 1.5, np.nan])
+    result = interpolate_columns(z.T, t.T, base, axis=1, fill_value=-999.9)
+    assert np.allclose(result, [3.0, -999.9, -999.9])
+
+
+def test_interpolate_columns_missing_level_outside_bracket():
+    """a missing level away from the target does not remove the column,
+    as with interp1d"""
+    height = np.linspace(20, -1, 22)
+    temperature = np.tile(np.linspace(220, 300, 22), (2, 1))
+    temperature[:, -1] = np.nan  # below ground bin
+    temperature[1, 3] = np.nan
+    base = np.array([5.25, 12.5])
+
+    result = interpolate_columns(height, temperature, base, axis=1)
+    for i in range(2):
+        valid = np.isfinite(temperature[i])
+        expected = interp1d(height[valid], temperature[i, valid])(base[i])
+        assert np.allclose(result[i], expected)
+    cube = interpolate_columns(
+        np.broadcast_to(height, temperature.shape), temperature, base, axis=1
+    )
+    assert np.allclose(cube, result)
+
+
+def test_interpolate_columns_shared_levels():
+    """1D levels shared by all columns give the same result as a full cube"""
+    rng = np.random.default_rng(2)
+    height = np.linspace(25, -1, 40)
+    temperature = rng.uniform(200, 300, (50, 40))
+    base = rng.uniform(-2, 26, 50)
+
+    result = interpolate_columns(height, temperature, base, axis=1)
+    expected = interpolate_columns(
+        np.broadcast_to(height, temperature.shape), temperature, base, axis=1
+    )
+    assert np.allclose(result, expected, equal_nan=True)
+    assert np.isnan(result[(base < -1) | (base > 25)]).all()
+
+
+def test_level_range_gives_same_samples():
+    """sampling on the levels bracketing the bases equals the full grid"""
+    rng = np.random.default_rng(3)
+    height = np.linspace(25, 0, 60)
+    temperature = rng.uniform(200, 300, (40, 60))
+    base = rng.uniform(3, 8, 40)
+    base[::4] = -9.9
+
+    first, last = get_level_range(height, base)
+    assert last - first < len(height) // 2
+    # missing bins outside the levels bracketing the bases
+    temperature[::3, last + 2] = np.nan
+    temperature[1::3, -1] = np.nan
+    temperature[2::5, max(first - 2, 0)] = np.nan
+    assert np.array_equal(
+        sample_profiles(temperature[:, first:last], height[first:last], base),
+        sample_profiles(temperature, height, base),
+    )
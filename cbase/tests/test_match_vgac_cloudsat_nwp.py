@@ -1,10 +1,23 @@
-from unittest.mock import MagicMock
+import os
+from unittest.mock import MagicMock, patch
 from datetime import datetime, timedelta
 import numpy as np
 import pytest
+import xarray as xr
 from cbase.data_readers.viirs import VGACData
 from cbase.data_readers.cloudsat import CloudsatData
+from cbase.matching.config import (
+    CNN_VGAC_PARAMETERS,
+    I1,
+    I2,
+    TIME_WINDOW,
+    XIMAGE_SIZE,
+    YIMAGE_SIZE,
+)
+from cbase.matching.encoding import EncodingProfile
 from cbase.matching.match_vgac_cloudsat_nwp import DataMatcher
+from cbase.matching.scene_writer import open_cnn_data
+from cbase.utils.utils import haversine_distance
 from cbase.tests.mock_data import (
     mock_lon,
     mock_lat,
@@ -13,6 +26,7 @@ from cbase.tests.mock_data import (
     mock_interp_flag_base,
     mock_interp_cloud_fraction,
     mock_interp_vis_optical_depth,
+    mock_crossing_orbit,
 )
 
 
@@ -31,6 +45,7 @@ def cloudsat_data():
     cloudsat.flag_base = np.array([1, 2, 3, 1, 2, 2, 1, 1, 2, 2])
     cloudsat.cloud_fraction = np.arange(0, 1, 0.1)
     cloudsat.vis_optical_depth = np.arange(10, 20, 1)
+    cloudsat.cloud_base_temp = np.arange(250, 260, 1)
     cloudsat.name = "cloudsat_file.hdf"
     return cloudsat
 
@@ -68,11 +83,273 @@ def test_match_vgac_cloudsat(setup_data_matcher):
     dm = setup_data_matcher  # class obj data matcher
 
     dm.match_vgac_cloudsat()
-    print(dm.collocated_data["vis_optical_depth"])
-    print(dm.collocated_data["cloud_fraction"])
-    assert np.array_equal(dm.collocated_data["cloud_base"], mock_interp_cloud_base)
-    assert np.array_equal(dm.collocated_data["cloud_top"], mock_interp_cloud_top)
-    assert np.array_equal(dm.collocated_data["flag_base"], mock_interp_flag_base)
+    collocated_data = {
+        key: dm.collocated_data.densify(key) for key in dm.collocated_data
+    }
+    print(collocated_data["vis_optical_depth"])
+    print(collocated_data["cloud_fraction"])
+    assert np.array_equal(collocated_data["cloud_base"], mock_interp_cloud_base)
+    assert np.array_equal(collocated_data["cloud_top"], mock_interp_cloud_top)
+    assert np.array_equal(collocated_data["flag_base"], mock_interp_flag_base)
     assert np.array_equal(
-        dm.collocated_data["vis_optical_depth"], mock_interp_vis_optical_depth
+        collocated_data["vis_optical_depth"], mock_interp_vis_optical_depth
+    )
+
+
+def test_match_pairs_cache(cloudsat_data, vgac_data, tmp_path):
+    """match pairs read back from the cache, without building the KD-tree,
+    the cache is keyed by the input files and the part of the Cloudsat
+    track"""
+    cloudsat_data.source_files = (("cloudsat_file.hdf", 100, 1),)
+    vgac_data.source_files = (("vgac_file.nc", 200, 1),)
+    vgac_data.scanline_offset = 0
+    vgac_data.name = "vgac_file.nc"
+    pairs = DataMatcher(
+        cloudsat_data, vgac_data, None, cache_path=tmp_path
+    ).find_match_pairs()
+    assert len(pairs.pixel) > 0
+
+    with patch.object(
+        DataMatcher, "_compute_match_pairs", side_effect=AssertionError
+    ), patch(
+        "cbase.matching.match_vgac_cloudsat_nwp.CollocationIndex",
+        side_effect=AssertionError,
+    ):
+        dm = DataMatcher(cloudsat_data, vgac_data, None, cache_path=tmp_path)
+        cached = dm.find_match_pairs()
+        dm.match_vgac_cloudsat(batched=True)
+    assert np.array_equal(cached.pixel, pairs.pixel)
+    assert np.array_equal(cached.profile, pairs.profile)
+    assert np.allclose(cached.distance, pairs.distance)
+    assert np.allclose(cached.time_diff, pairs.time_diff)
+
+    cache_file = dm.match_pairs_cache_file()
+    vgac_data.source_files = (("vgac_file.nc", 200, 2),)  # reprocessed
+    assert DataMatcher(
+        cloudsat_data, vgac_data, None, cache_path=tmp_path
+    ).match_pairs_cache_file() not in (cache_file, None)
+    vgac_data.source_files = (("vgac_file.nc", 200, 1),)
+    cloudsat_data.time = cloudsat_data.time + timedelta(seconds=1)  # other subset
+    assert DataMatcher(
+        cloudsat_data, vgac_data, None, cache_path=tmp_path
+    ).match_pairs_cache_file() != cache_file
+    assert os.listdir(tmp_path) == [os.path.basename(cache_file)]
+
+
+@pytest.mark.parametrize("cloud_free", [slice(0, 0), slice(0, 6)])
+def test_batched_matching_same_as_per_scan(cloudsat_data, vgac_data, cloud_free):
+    """batched matching gives the same collocations as the per scan loop,
+    also when scans are skipped for a cloud free part of the track"""
+    cloudsat_data.cloud_base[cloud_free] = -999.9
+    collocated_data = []
+    for batched in (False, True):
+        dm = DataMatcher(cloudsat_data, vgac_data, None)
+        dm.match_vgac_cloudsat(batched=batched)
+        collocated_data.append(
+            {key: dm.collocated_data.densify(key) for key in dm.collocated_data}
+        )
+    for key, values in collocated_data[0].items():
+        assert np.array_equal(values, collocated_data[1][key])
+    assert np.any(collocated_data[0]["cloud_top"] > 0)
+
+
+def brute_force_segment(dm: DataMatcher, itime: int):
+    """nearest profile within TIME_WINDOW of the swath centre, and the first
+    and last profile within 1.5 degrees of it, one scan at a time"""
+    window = np.array(TIME_WINDOW) * np.timedelta64(1, "m")
+    in_window = np.flatnonzero(
+        (dm.cloudsat_time64 >= dm.scan_time64[itime] + window[0])
+        & (dm.cloudsat_time64 <= dm.scan_time64[itime] + window[1])
+    )
+    if len(in_window) == 0:
+        return None
+    center = dm.vgac.latitude.shape[1] // 2
+    distance = haversine_distance(
+        dm.vgac.latitude[itime, center],
+        dm.vgac.longitude[itime, center],
+        dm.cloudsat.latitude[in_window],
+        dm.cloudsat.longitude[in_window],
+    )
+    index = in_window[np.argmin(distance)]
+    inside = np.flatnonzero(
+        (np.abs(dm.cloudsat.latitude - dm.cloudsat.latitude[index]) < 1.5)
+        & (np.abs(dm.cloudsat.longitude - dm.cloudsat.longitude[index]) < 1.5)
+    )
+    return inside[0], inside[-1]
+
+
+def test_sweep_track_segments_same_as_brute_force():
+    """the sweep gives the same track segment for every scan as searching
+    each scan on its own, on an orbit with a Cloudsat track crossing the
+    swath and extending beyond it in time"""
+    cloudsat_geolocation, vgac_geolocation = mock_crossing_orbit(1200, 6000)
+    vgac = MagicMock(spec=VGACData)
+    for key, values in vgac_geolocation.items():
+        setattr(vgac, key, values)
+    cloudsat = MagicMock(spec=CloudsatData)
+    for key, values in cloudsat_geolocation.items():
+        setattr(cloudsat, key, values)
+    cloudsat.name = "cloudsat_file.hdf"
+
+    dm = DataMatcher(cloudsat, vgac, None)
+    segments = dm.sweep_track_segments()
+    assert len(segments) == 1200
+    for itime, segment in enumerate(segments):
+        assert segment == brute_force_segment(dm, itime)
+
+
+def test_make_dataset_fill_value_round_trip(setup_data_matcher, tmp_path):
+    """fill values of packed parameters in the returned dataset read back
+    as missing after to_netcdf, instead of wrapping around in int16"""
+    scene = {
+        "M14": np.full((YIMAGE_SIZE, XIMAGE_SIZE), 280.0),
+        "cloud_base": np.full((YIMAGE_SIZE, XIMAGE_SIZE), 500.0),
+    }
+    scene["M14"][0, :] = -999.9
+    ds = setup_data_matcher._make_dataset([scene], EncodingProfile())
+    filename = os.path.join(tmp_path, "cnn_data.nc")
+    ds.to_netcdf(filename)
+
+    with xr.open_dataset(filename) as read_back:
+        assert np.all(np.isnan(read_back.M14[0, 0, :]))
+        assert np.allclose(read_back.M14[0, 1:, :], 280.0, atol=0.005)
+        assert np.all(read_back.cloud_base == 500.0)
+
+
+class FakeEra5:
+    """NWP fields as functions of the longitude and latitude they are
+    regridded to, recording the projections that were set"""
+
+    def __init__(self, nlevel: int = 5):
+        self.nlevel = nlevel
+        self.projections = []
+
+    def get_fields(self, parameters, projection, fill_value=None):
+        self.projections.append(projection)
+        lon, lat = projection
+        level = np.arange(self.nlevel)[:, np.newaxis, np.newaxis]
+        fields = {}
+        for i, parameter in enumerate(parameters):
+            if parameter == "p_vertical":
+                fields[parameter] = 1000 - 150 * level - 0.1 * lat + 0 * lon
+            elif parameter.endswith("_vertical"):
+                fields[parameter] = 800 * level + 0.1 * lat + 0.01 * lon
+            else:
+                fields[parameter] = i + lat + 0.01 * lon
+        return fields
+
+
+def make_granule_matcher(scanline_offset: int = 0, nscan: int = 900, npix: int = 200):
+    """DataMatcher of a VGAC granule read from scanline_offset on, with
+    cloud bases collocated along column 100 and a fake ERA5"""
+    start_time = np.datetime64("2018-05-30T01:00", "ns")
+    scan, pixel = np.arange(nscan)[:, np.newaxis], np.arange(npix)
+    vgac = MagicMock(spec=VGACData)
+    vgac.latitude = -10 + 0.01 * scan + 0.001 * pixel
+    vgac.longitude = 20 + 0.01 * pixel + 0 * scan
+    vgac.time = start_time + (360 * np.arange(nscan)).astype("timedelta64[ms]")
+    vgac.pixel_time = np.broadcast_to(vgac.time[:, np.newaxis], vgac.latitude.shape)
+    for parameter in CNN_VGAC_PARAMETERS[3:]:
+        setattr(vgac, parameter, 250 + 0.1 * scan + 0.01 * pixel)
+    vgac.scanline_offset = scanline_offset
+    vgac.name = "vgac_file.nc"
+    cloudsat = MagicMock(spec=CloudsatData)
+    cloudsat.latitude = vgac.latitude[:, 100]
+    cloudsat.longitude = vgac.longitude[:, 100]
+    cloudsat.time = vgac.time
+    cloudsat.name = "cloudsat_file.hdf"
+
+    dm = DataMatcher(cloudsat, vgac, FakeEra5())
+    row = np.arange(nscan)
+    dm.collocated_data.set(
+        row,
+        np.full(nscan, 100),
+        {
+            "cloud_base": 500.0 + row,
+            "cloud_top": 2000.0 + row,
+            "cloud_base_temp": 270.0 - 0.01 * row,
+        },
+    )
+    return dm
+
+
+def test_nwp_per_granule_same_as_per_scene():
+    """scenes cut from the NWP fields regridded once for the granule part
+    in I1:I2 are the same as scenes regridded one by one, scenes outside
+    I1:I2 are regridded on their own"""
+    datasets, nprojections = [], []
+    for nwp_per_granule in (False, True):
+        dm = make_granule_matcher(scanline_offset=100)
+        datasets.append(
+            dm.create_cnn_dataset_with_nwp(
+                to_file=False, nwp_per_granule=nwp_per_granule
+            )
+        )
+        nprojections.append(len(dm.era5.projections))
+
+    boxes = dm.scene_boxes()
+    region = dm._nwp_granule_region(boxes)
+    assert len(boxes) == 6
+    assert region.i1 + 100 >= I1 and region.i2 + 100 <= I2
+    assert sum(region.i1 <= box.i1 and box.i2 <= region.i2 for box in boxes) == 4
+    assert nprojections == [6, 1 + 2]
+    xr.testing.assert_identical(datasets[0], datasets[1])
+    cloudy = datasets[0].cloud_base > 0
+    assert cloudy.sum() == 6 * YIMAGE_SIZE
+    assert np.all(datasets[0].base_pressure.values[cloudy.values] > 0)
+
+
+@pytest.mark.parametrize("backend", ["netcdf", "zarr"])
+def test_streamed_scenes_same_as_dataset(backend, tmp_path):
+    """scenes streamed to file by the scene writer read back as the in
+    memory dataset written with the same encoding"""
+    if backend == "zarr":
+        pytest.importorskip("zarr")
+    dm = make_granule_matcher(nscan=400)
+    dm.out_filename = os.path.join(tmp_path, "cnn_data.nc")
+    reference_file = os.path.join(tmp_path, "reference.nc")
+    dataset = dm.create_cnn_dataset_with_nwp(to_file=False)
+    assert dataset.sizes["nscene"] == 2
+    dataset.to_netcdf(reference_file)
+
+    assert dm.create_cnn_dataset_with_nwp(to_file=True, backend=backend) is None
+    filename = os.path.join(
+        tmp_path, "cnn_data.nc" if backend == "netcdf" else "cnn_data.zarr"
     )
+    with open_cnn_data(filename) as streamed, open_cnn_data(reference_file) as ds:
+        assert set(streamed.data_vars) == set(ds.data_vars)
+        xr.testing.assert_equal(streamed.load(), ds.load())
+
+
+def dense_scene_boxes(dm: DataMatcher) -> list:
+    """scene boxes selected as from the dense collocated arrays: in every
+    YIMAGE_SIZE:th row of the granule the first column with a cloud base"""
+    cloud_base = dm.collocated_data.densify("cloud_base")
+    first_row = -dm.vgac.scanline_offset % YIMAGE_SIZE
+    boxes = []
+    for ipix in range(first_row, len(cloud_base), YIMAGE_SIZE):
+        iscan = np.where(cloud_base[ipix, :] > 0)[0]
+        if len(iscan) > 0:
+            box = dm._bounding_box(ipix, iscan[0])
+            if (box.i2 - box.i1, box.j2 - box.j1) == (YIMAGE_SIZE, XIMAGE_SIZE):
+                boxes.append(box)
+    return boxes
+
+
+@pytest.mark.parametrize("scanline_offset", [0, 100])
+def test_scene_boxes_same_as_dense(scanline_offset):
+    """scenes selected from the sparse collocated data are those selected
+    from the dense arrays, with pixels set more than once, clear pixels
+    left of the first cloud base and first cloud bases near the edge"""
+    dm = make_granule_matcher(scanline_offset, npix=400)
+    dm.collocated_data.add_parameter("cloud_base", -999.9, float)
+    rng = np.random.default_rng(1)
+    for _ in range(2):
+        row = rng.integers(0, 900, 1000)
+        col = rng.integers(0, 400, 1000)
+        cloud_base = rng.choice([-999.9, 0.0, 300.0, 1200.0], 1000)
+        dm.collocated_data.set(row, col, {"cloud_base": cloud_base})
+
+    boxes = dm.scene_boxes()
+    assert len(boxes) == 4
+    assert boxes == dense_scene_boxes(dm)
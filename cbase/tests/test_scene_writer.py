@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import pytest
+import xarray as xr
+from cbase.matching.config import XIMAGE_SIZE, YIMAGE_SIZE
+from cbase.matching.encoding import EncodingProfile
+from cbase.matching.scene_writer import NetCDFSceneWriter, ZarrSceneWriter, iter_scenes
+
+
+def make_scene(value: float) -> dict:
+    return {
+        "cloud_base": np.full((YIMAGE_SIZE, XIMAGE_SIZE), value),
+        "ct": np.full((YIMAGE_SIZE, XIMAGE_SIZE), int(value), dtype=np.int32),
+        "M14": np.full((YIMAGE_SIZE, XIMAGE_SIZE), 250.0 + value / 3),
+    }
+
+
+def test_scenes_are_appended(tmp_path):
+    """scenes end up along nscene in the order they were written"""
+    filename = os.path.join(tmp_path, "cnn_data.nc")
+    encoding = EncodingProfile(compression=None, dtype="float64", packed={})
+    with NetCDFSceneWriter(filename, encoding) as writer:
+        for value in (1.0, 2.0, 3.0):
+            writer.write_scene(make_scene(value))
+
+    with xr.open_dataset(filename) as ds:
+        assert ds.sizes["nscene"] == 3
+        assert np.array_equal(ds.nscene, [0, 1, 2])
+        assert np.array_equal(ds.cloud_base[:, 0, 0], [1.0, 2.0, 3.0])
+        assert ds.ct.dtype == np.int32
+        assert ds.M14.dtype == np.float64
+
+
+def test_default_encoding(tmp_path):
+    """compressed float32 and int16 packed parameters read back within
+    the packing precision"""
+    filename = os.path.join(tmp_path, "cnn_data.nc")
+    scene = make_scene(2.0)
+    scene["ct"] = scene["ct"].astype(np.float64)
+    scene["ct"][0, :] = np.nan
+    with NetCDFSceneWriter(filename) as writer:
+        writer.write_scene(scene)
+
+    with xr.open_dataset(filename, mask_and_scale=False) as ds:
+        assert ds.cloud_base.dtype == np.float32
+        assert ds.M14.dtype == np.int16
+        assert ds.cloud_base.encoding["chunksizes"] == (1, YIMAGE_SIZE, XIMAGE_SIZE)
+        assert ds.cloud_base.encoding["zlib"]
+    with xr.open_dataset(filename) as ds:
+        assert np.allclose(ds.M14, scene["M14"], atol=0.005)
+        assert np.all(np.isnan(ds.ct[0, 0, :]))
+        assert np.all(ds.ct[0, 1:, :] == 2)
+
+
+def test_no_file_after_error(tmp_path):
+    """a failing run does not leave a partly written file"""
+    filename = os.path.join(tmp_path, "cnn_data.nc")
+    with pytest.raises(RuntimeError):
+        with NetCDFSceneWriter(filename) as writer:
+            writer.write_scene(make_scene(1.0))
+            raise RuntimeError("failed")
+    assert os.listdir(tmp_path) == []
+
+
+def test_zarr_store_one_chunk_per_scene(tmp_path):
+    """scenes in a Zarr store are chunked per scene and read one by one"""
+    pytest.importorskip("zarr")
+    filename = os.path.join(tmp_path, "cnn_data.zarr")
+    with ZarrSceneWriter(filename) as writer:
+        for value in (1.0, 2.0):
+            writer.write_scene(make_scene(value))
+
+    scenes = list(iter_scenes(filename))
+    assert len(scenes) == 2
+    assert scenes[1].cloud_base.dims == ("npix", "nscan")
+    assert np.all(scenes[1].cloud_base == 2.0)
+    assert np.allclose(scenes[1].M14, 250.0 + 2.0 / 3, atol=0.005)
+    assert scenes[0].M14.encoding["chunks"] == (1, YIMAGE_SIZE, XIMAGE_SIZE)
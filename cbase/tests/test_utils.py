@@ -0,0 +1,18 @@
+import numpy as np
+from cbase.utils.utils import tai93_to_datetime64, utc_fields_to_datetime64
+
+
+def test_tai93_to_datetime64():
+    """TAI seconds since 1993 keep sub-second precision, missing give NaT"""
+    times = tai93_to_datetime64(np.array([0.0, 86400.25, np.nan]))
+    assert times[0] == np.datetime64("1993-01-01T00:00:00")
+    assert times[1] == np.datetime64("1993-01-02T00:00:00.250")
+    assert np.isnat(times[2])
+
+
+def test_utc_fields_to_datetime64():
+    """ATMS like UTC fields with milli- and microseconds"""
+    fields = np.array([[2020, 2, 29, 23, 59, 58, 123, 456], [np.nan] * 8])
+    times = utc_fields_to_datetime64(fields)
+    assert times[0] == np.datetime64("2020-02-29T23:59:58.123456")
+    assert np.isnat(times[1])
@@ -0,0 +1,88 @@
+import os
+from pathlib import Path
+import numpy as np
+import xarray as xr
+from cbase.data_readers import viirs
+
+L1C_NAME = "S_NWC_viirs_npp_00000_20180530T0100000Z_20180530T0200000Z.nc"
+
+
+def make_pps_files(pps_path: str, nscan: int = 30, npix: int = 8) -> dict:
+    """small PPS product files of one granule, the values of each variable
+    are its row index plus an offset per variable"""
+    output_path, aux_path, *filenames = viirs.get_pps_data_files(
+        Path("/l1c/2018/05/30") / L1C_NAME
+    )
+    paths = [output_path] * 5 + [aux_path]
+    expected = {}
+    for offset, (product, path, filename) in enumerate(
+        zip(viirs.PPS_PRODUCT_VARIABLES, paths, filenames)
+    ):
+        os.makedirs(path, exist_ok=True)
+        ds = xr.Dataset()
+        for i, (name, variable) in enumerate(
+            viirs.PPS_PRODUCT_VARIABLES[product].items()
+        ):
+            values = np.arange(nscan)[:, np.newaxis] + np.zeros((nscan, npix))
+            values += 100 * offset + 10 * i
+            ds[variable] = (("time", "y", "x"), values[np.newaxis])
+            expected[name] = values
+        ds.to_netcdf(os.path.join(path, filename))
+    return expected
+
+
+def test_get_pps_data(tmp_path, monkeypatch):
+    """all products are read, only the requested scanlines"""
+    monkeypatch.setattr(viirs, "VGAC_PPS_PATH", os.path.join(tmp_path, "export"))
+    expected = make_pps_files(viirs.VGAC_PPS_PATH)
+
+    pps_data = viirs.get_pps_data(Path("/l1c/2018/05/30") / L1C_NAME, (5, 12))
+    assert sorted(pps_data) == sorted(expected)
+    for name, values in expected.items():
+        assert np.array_equal(pps_data[name], values[5:12])
+    pps_data = viirs.get_pps_data(Path("/l1c/2018/05/30") / L1C_NAME)
+    assert np.array_equal(pps_data["land_use"], expected["land_use"])
+
+
+def make_l1c_file(filename: Path, nscan: int = 30, npix: int = 8):
+    """small VGAC PPS L1C file, the images are their row index plus an
+    offset per image"""
+    start_time = np.datetime64("2018-05-30T01:00", "ns")
+    scan_time = start_time + np.arange(nscan) * np.timedelta64(1500, "ms")
+    row = np.arange(nscan)[:, np.newaxis] + np.zeros((nscan, npix))
+    ds = xr.Dataset(
+        {
+            "lat": (("y", "x"), -10 + 0.1 * row),
+            "lon": (("y", "x"), -20 + 0.1 * row),
+            "scanline_timestamps": (("y",), scan_time),
+        }
+    )
+    for i, variable in enumerate(viirs.PPS_IMAGE_VARIABLES.values()):
+        ds[variable] = (("time", "y", "x"), (1000 * i + row)[np.newaxis])
+    ds.to_netcdf(filename)
+
+
+def test_vgac_pps_from_file(tmp_path, monkeypatch):
+    """only the requested images and scanlines are read, the images are
+    read lazily after the file was closed"""
+    monkeypatch.setattr(viirs, "VGAC_PPS_PATH", os.path.join(tmp_path, "export"))
+    expected = make_pps_files(viirs.VGAC_PPS_PATH)
+    l1c_path = Path(tmp_path) / "l1c" / "2018" / "05" / "30"
+    os.makedirs(l1c_path)
+    make_l1c_file(l1c_path / L1C_NAME)
+
+    vgac = viirs.VGACPPSData.from_file(
+        l1c_path / L1C_NAME, ["M14", "satzenith"], scanlines=(5, 12)
+    )
+    assert vgac.scanline_offset == 5
+    assert vgac.latitude.shape == (7, 8)
+    rows = np.arange(5, 12)
+    assert np.allclose(vgac.latitude[:, 0], -10 + 0.1 * rows)
+    assert np.allclose(vgac.longitude[:, 0], 340 + 0.1 * rows)
+    assert vgac.M01 is None and vgac.sunzenith is None
+    assert np.array_equal(np.asarray(vgac.M14)[:, 0], 1000 * 13 + rows)
+    assert np.array_equal(np.asarray(vgac.satzenith)[:, 0], 1000 * 16 + rows)
+    assert np.array_equal(vgac.ctp, expected["ctth_pres"][5:12])
+    assert vgac.pixel_time.shape == (7, 8)
+    assert np.all(vgac.pixel_time[3] == vgac.time[3])
+    assert vgac.time[1] - vgac.time[0] == np.timedelta64(1500, "ms")
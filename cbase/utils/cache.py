@@ -0,0 +1,45 @@
+import os
+import hashlib
+import tempfile
+from typing import Union
+import numpy as np
+
+
+def cache_key(*parts) -> str:
+    """short hash identifying the inputs and settings of a cached result"""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+
+def file_identity(filename: str) -> tuple:
+    """name, size and modification time of an input file, part of the cache
+    key so that cached results are not used when the file is replaced"""
+    stat = os.stat(filename)
+    return (os.path.basename(filename), stat.st_size, stat.st_mtime_ns)
+
+
+def load_npz_cache(filename: str) -> Union[dict, None]:
+    """read all arrays of a cache file, None if it does not exist or is broken"""
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with np.load(filename) as cache:
+            return {key: cache[key] for key in cache.files}
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable cache file {filename}: {e}")
+        return None
+
+
+def save_npz_cache(filename: str, arrays: dict):
+    """write arrays to a compressed cache file, the file is replaced
+    atomically so parallel runs never see a partly written cache"""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    fd, tmp_filename = tempfile.mkstemp(
+        dir=os.path.dirname(filename), suffix=".npz.tmp"
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.remove(tmp_filename)
+        raise
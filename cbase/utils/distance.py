@@ -0,0 +1,46 @@
+from typing import Union
+import numpy as np
+from cbase.utils.utils import R
+
+
+def lonlat2xyz(
+    lon: np.ndarray, lat: np.ndarray, dtype: np.dtype = np.float64
+) -> np.ndarray:
+    """
+    convert lon/lat in degrees to unit vectors on the sphere,
+    the result has shape lon.shape + (3,)
+    """
+    lon_rad = np.radians(np.asarray(lon, dtype=np.float64))
+    lat_rad = np.radians(np.asarray(lat, dtype=np.float64))
+    xyz = np.empty(lon_rad.shape + (3,), dtype=dtype)
+    cos_lat = np.cos(lat_rad)
+    xyz[..., 0] = cos_lat * np.cos(lon_rad)
+    xyz[..., 1] = cos_lat * np.sin(lon_rad)
+    xyz[..., 2] = np.sin(lat_rad)
+    return xyz
+
+
+def km2chord(distance: float) -> float:
+    """great circle distance in km to chord length on the unit sphere"""
+    return 2 * np.sin(np.asarray(distance) / (2 * R))
+
+
+def chord2km(chord: np.ndarray) -> np.ndarray:
+    """chord length on the unit sphere to great circle distance in km"""
+    return 2 * R * np.arcsin(np.clip(np.asarray(chord) / 2, 0, 1))
+
+
+def chord_squared(
+    xyz1: np.ndarray,
+    xyz2: np.ndarray,
+    out: Union[np.ndarray, None] = None,
+    dtype: np.dtype = np.float32,
+) -> np.ndarray:
+    """
+    squared chord length between unit vectors of shape (..., 3), broadcast
+    against each other. Computed in dtype from the coordinate differences,
+    float32 keeps ~1 m precision at km distances, optionally into out
+    """
+    diff = np.subtract(xyz1, xyz2, dtype=dtype)
+    np.multiply(diff, diff, out=diff)
+    return np.sum(diff, axis=-1, out=out)
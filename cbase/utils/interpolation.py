@@ -0,0 +1,66 @@
+import numpy as np
+
+
+def interpolate_columns(
+    x: np.ndarray,
+    y: np.ndarray,
+    x_new: np.ndarray,
+    axis: int = 0,
+    fill_value: float = np.nan,
+) -> np.ndarray:
+    """
+    linear interpolation of many columns at once, e.g. pressure or
+    temperature as function of height for every pixel of a scene.
+    x and y hold the columns along axis, x may also be 1D when all columns
+    share the same levels. x_new has the shape of y without axis.
+    The columns do not need to be sorted. Targets outside the finite levels
+    of the column, non finite targets and targets between two levels where
+    x or y is not finite give fill_value. Non finite values elsewhere in the
+    column do not matter, like scipy.interpolate.interp1d(x, y,
+    bounds_error=False) for each column
+    """
+    y = np.moveaxis(np.asarray(y), axis, -1)
+    x_new = np.asarray(x_new)
+    x = np.asarray(x)
+    if x.ndim > 1:
+        x = np.moveaxis(x, axis, -1)
+    if x.shape[-1] != y.shape[-1] or y.shape[:-1] != x_new.shape:
+        raise ValueError(
+            f"Shapes {x.shape}, {y.shape} and {x_new.shape} do not match"
+        )
+    nlev = y.shape[-1]
+
+    order = np.argsort(x, axis=-1)
+    x = np.take_along_axis(x, order, axis=-1)
+    if x.ndim == 1:
+        # shared levels, bracketing by binary search on the single column
+        k = np.clip(np.searchsorted(x, x_new, side="left"), 1, nlev - 1)
+        x0, x1 = x[k - 1], x[k]
+        y0 = np.take_along_axis(y, order[k - 1][..., np.newaxis], axis=-1)[..., 0]
+        y1 = np.take_along_axis(y, order[k][..., np.newaxis], axis=-1)[..., 0]
+    else:
+        y = np.take_along_axis(y, order, axis=-1)
+        # bracketing levels, x[k - 1] <= x_new <= x[k]
+        target = x_new[..., np.newaxis]
+        k = np.clip(np.sum(x < target, axis=-1), 1, nlev - 1)[..., np.newaxis]
+        x0 = np.take_along_axis(x, k - 1, axis=-1)[..., 0]
+        x1 = np.take_along_axis(x, k, axis=-1)[..., 0]
+        y0 = np.take_along_axis(y, k - 1, axis=-1)[..., 0]
+        y1 = np.take_along_axis(y, k, axis=-1)[..., 0]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weight = np.where(x1 > x0, (x_new - x0) / (x1 - x0), 0.0)
+        result = y0 + weight * (y1 - y0)
+
+    # missing levels are sorted last, the range is that of the finite levels
+    invalid = (
+        ~np.isfinite(x_new)
+        | ~(x_new >= np.fmin.reduce(x, axis=-1))
+        | ~(x_new <= np.fmax.reduce(x, axis=-1))
+        | ~np.isfinite(x0)
+        | ~np.isfinite(x1)
+        | ~np.isfinite(y0)
+        | ~np.isfinite(y1)
+    )
+    result[invalid] = fill_value
+    return result
@@ -6,6 +6,8 @@ import xarray as xr
 
 
 R = 6371.0  # Earth's radius in kilometers
+UNIX_EPOCH = np.datetime64("1970-01-01T00:00:00", "ns")
+TAI93_EPOCH = np.datetime64("1993-01-01T00:00:00", "ns")  # Cloudsat TAI reference
 
 
 def check_lon_range(lons):
@@ -64,6 +66,72 @@ def microseconds_to_datetime(microseconds) -> datetime:
     )
 
 
+def datetime_to_datetime64(times: np.ndarray) -> np.ndarray:
+    """convert an array of (UTC) datetime objects to datetime64[us],
+    datetime64 input is only cast"""
+    times = np.asarray(times)
+    if np.issubdtype(times.dtype, np.datetime64):
+        return times.astype("datetime64[us]")
+    microseconds = np.array([time.timestamp() for time in times.ravel()]) * 1e6
+    return (
+        np.round(microseconds)
+        .astype("int64")
+        .view("datetime64[us]")
+        .reshape(times.shape)
+    )
+
+
+def seconds_to_datetime64(
+    seconds: np.ndarray, epoch: np.datetime64 = UNIX_EPOCH
+) -> np.ndarray:
+    """
+    convert seconds since epoch to datetime64[ns] in one array operation,
+    independent of the local time zone. Whole and fractional seconds are
+    converted separately to keep ns precision, non finite values give NaT
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    valid = np.isfinite(seconds)
+    whole = np.floor(np.where(valid, seconds, 0))
+    nanoseconds = whole.astype(np.int64) * 1_000_000_000 + np.round(
+        (np.where(valid, seconds, 0) - whole) * 1e9
+    ).astype(np.int64)
+    times = np.datetime64(epoch, "ns") + nanoseconds.astype("timedelta64[ns]")
+    times[~valid] = np.datetime64("NaT")
+    return times
+
+
+def tai93_to_datetime64(seconds: np.ndarray) -> np.ndarray:
+    """convert Cloudsat TAI time, seconds since 1993-01-01 00:00 UTC without
+    leap seconds, to datetime64[ns]"""
+    return seconds_to_datetime64(seconds, TAI93_EPOCH)
+
+
+def utc_fields_to_datetime64(fields: np.ndarray) -> np.ndarray:
+    """
+    convert UTC times given as year, month, day, hour, minute, second and
+    optionally millisecond and microsecond along the last axis to
+    datetime64[ns]. Times with any missing element are set to NaT
+    """
+    fields = np.asarray(fields, dtype=float)
+    nan_mask = np.any(np.isnan(fields), axis=-1)
+    fields = np.where(nan_mask[..., np.newaxis], 0, fields)
+    fields[nan_mask, :3] = [1970, 1, 1]
+    fields = np.moveaxis(fields.astype(np.int64), -1, 0)
+    year, month, day, hour, minute = fields[:5]
+
+    months = (year - 1970) * 12 + month - 1
+    times = (
+        months.astype("datetime64[M]").astype("datetime64[ns]")
+        + (day - 1).astype("timedelta64[D]")
+        + hour.astype("timedelta64[h]")
+        + minute.astype("timedelta64[m]")
+    )
+    for values, unit in zip(fields[5:], ["s", "ms", "us"]):
+        times = times + values.astype(f"timedelta64[{unit}]")
+    times[nan_mask] = np.datetime64("NaT")
+    return times
+
+
 def haversine_distance(
     lat1: float, lon1: float, lat2: np.array, lon2: np.array
 ) -> np.array:
@@ -18,7 +18,7 @@ def parse_args():
         "--inpath",
         type=str,
         required=True,
-        help="Path to the input data directory containing NetCDF files.",
+        help="Path to the input data directory containing NetCDF files or Zarr stores.",
     )
     parser.add_argument(
         "--train-ratio",
@@ -48,7 +48,9 @@ def main():
     # Parse the command-line arguments
     args = parse_args()
 
-    input_files = glob(os.path.join(args.inpath, "cnn*nc"))
+    input_files = glob(os.path.join(args.inpath, "cnn*nc")) + glob(
+        os.path.join(args.inpath, "cnn*zarr")
+    )
 
     if len(input_files) == 0:
         print("No input files found with the given pattern.")
@@ -2,11 +2,21 @@ from pathlib import Path
 import os
 from sys import argv
 import argparse
+import numpy as np
 from cbase.matching.match_csat_vgac_nwp_filenames import (
     get_matching_cloudsat_vgac_nwp_files,
 )
 from cbase.data_readers import cloudsat, viirs, era5
 from cbase.matching.match_vgac_cloudsat_nwp import DataMatcher
+from cbase.data_readers.cloudsat import read_cloudsat_geolocation
+from cbase.data_readers.viirs import read_vgac_geolocation
+from cbase.matching.config import (
+    CACHE_PATH,
+    CNN_VGAC_PARAMETERS,
+    CNN_VGAC_PPS_PARAMETERS,
+    TIME_DIFF_ALLOWED,
+)
+from cbase.matching.footprint import collocation_scanlines, footprints_overlap
 
 # python run_process.py -CPATH /home/a002602/data/cloud_base/cloudsat/*20183*CLDCLASS-LIDAR* -DPATH /home/a002602/data/cloud_base/dardar/* -VPATH /home/a002602/data/cloud_base/vgac/* -NPATH /home/a002602/data/cloud_base/NWP/*
 
@@ -18,18 +28,38 @@ def process(
     nwp_file: Path,
 ):
     """main process"""
+    # skip pairs of granules that cannot overlap, before the heavy reading
+    cloudsat_geolocation = read_cloudsat_geolocation(cldclass_lidar_file.as_posix())
+    vgac_geolocation = read_vgac_geolocation(vgac_file)
+    if not footprints_overlap(cloudsat_geolocation, vgac_geolocation):
+        print(f"No overlap of {cldclass_lidar_file} and {vgac_file}, skipping")
+        return
+    # only the channels of the CNN and the scanlines near the Cloudsat pass
+    scanlines = collocation_scanlines(
+        cloudsat_geolocation["time"], vgac_geolocation["time"]
+    )
+
     # read in data
     if os.path.basename(vgac_file.as_posix())[:4] == "VGAC":
-        vgc = viirs.VGACData.from_file(vgac_file)
+        vgc = viirs.VGACData.from_file(vgac_file, CNN_VGAC_PARAMETERS, scanlines)
     elif os.path.basename(vgac_file.as_posix())[:4] == "S_NW":
-        vgc = viirs.VGACPPSData.from_file(vgac_file)
+        vgc = viirs.VGACPPSData.from_file(
+            vgac_file, CNN_VGAC_PPS_PARAMETERS, scanlines
+        )
     else:
         raise ValueError(f"this file not supported {vgac_file}")
     nwp = era5.Era5.from_file(nwp_file)
-    cld = cloudsat.CloudsatData.from_files(cldclass_lidar_file, dardar_file)
+    # only the Cloudsat profiles that can be collocated with the VGAC scans
+    allowed = TIME_DIFF_ALLOWED * np.timedelta64(1, "m")
+    cld = cloudsat.CloudsatData.from_files(
+        cldclass_lidar_file,
+        dardar_file,
+        time_range=(vgc.time.min() - allowed, vgc.time.max() + allowed),
+        cache_path=CACHE_PATH,
+    )
 
     # create matching object
-    dm = DataMatcher(cld, vgc, nwp)
+    dm = DataMatcher(cld, vgc, nwp, cache_path=CACHE_PATH)
     dm.match_vgac_cloudsat()
     dm.create_cnn_dataset_with_nwp()
 
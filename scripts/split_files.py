@@ -1,16 +1,18 @@
-import xarray as xr
 import glob
 import os
 from tqdm import tqdm
+from cbase.matching.scene_writer import iter_scenes
+
+# Zarr stores (DataMatcher backend "zarr") have one chunk per scene and can
+# be read scene by scene with iter_scenes, they do not need to be split
 
 
 def split_files(files):
     for ix, file in tqdm(enumerate(files)):
-        with xr.open_dataset(file) as ds:
-            for i in range(len(ds.nscene)):
-                outfile = os.path.basename(file)[:-3] + f"_{i}.nc"
-                # if np.sum(ds.sel(nscene=i).cloud_base.values < 60):
-                ds.sel(nscene=i).to_netcdf(os.path.join(outpath, outfile))
+        for i, ds in enumerate(iter_scenes(file)):
+            outfile = os.path.splitext(os.path.basename(file))[0] + f"_{i}.nc"
+            # if np.sum(ds.cloud_base.values < 60):
+            ds.to_netcdf(os.path.join(outpath, outfile))
 
 
 files = glob.glob(